@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming buzzer audio.
+
+The core calls tick on its attached audio once per 60 Hz timer tick. StreamingAudio has a ToneGenerator synthesize
+that frame's worth of samples into one reused buffer, a square wave while the sound timer runs, or the machine's audio
+pattern when it has one (XO-CHIP), and silence otherwise, carrying the phase over so consecutive frames join up
+without gaps. The block is handed to a sink: PygletStream plays it, NullSink throws it away for headless runs.
+"""
+import threading
+
+import pyglet
+
+# 8 bit unsigned mono
+SAMPLE_RATE = 44100
+FRAME_SAMPLES = SAMPLE_RATE // 60
+SILENCE = 128
+
+
+class ToneGenerator(object):
+    """
+    Synthesizes the buzzer a frame at a time into a reused buffer
+    """
+
+    def __init__(self, frequency=441, volume=0.25) -> None:
+        super().__init__()
+        self.block = bytearray(FRAME_SAMPLES)
+        self.silence = bytes([SILENCE]) * FRAME_SAMPLES
+        amplitude = round(127 * volume)
+        # one period of the square wave, repeated until any frame can be sliced out of it from any phase
+        self.period = max(round(SAMPLE_RATE / frequency), 2)
+        wave = bytes([SILENCE + amplitude]) * (self.period // 2) + bytes([SILENCE - amplitude]) * (self.period - self.period // 2)
+        self.wave = memoryview(wave * (FRAME_SAMPLES // self.period + 2))
+        self.phase = 0
+        # audio pattern bits as sample levels, and the pattern they were expanded from
+        self.high = SILENCE + amplitude
+        self.low = SILENCE - amplitude
+        self.levels = bytearray(128)
+        self.pattern = None
+        # position in the pattern, in bits
+        self.pattern_phase = 0.0
+
+    def render(self, c8):
+        """
+        Fills the block with the frame's samples
+        :param c8:
+        :return: bytearray, reused by the next call
+        """
+        block = self.block
+        if not c8.sound_timer:
+            block[:] = self.silence
+            # each beep starts at the top of the wave
+            self.phase = 0
+            self.pattern_phase = 0.0
+        elif c8.audio_pattern is None:
+            block[:] = self.wave[self.phase:self.phase + FRAME_SAMPLES]
+            self.phase = (self.phase + FRAME_SAMPLES) % self.period
+        else:
+            self.render_pattern(c8.audio_pattern, c8.pitch)
+        return block
+
+    def render_pattern(self, pattern, pitch):
+        """
+        Plays the 128 bit audio pattern into the block at 4000 * 2 ** ((pitch - 64) / 48) bits a second
+        :param pattern: 16 bytes, the first bit played being the most significant of the first byte
+        :param pitch:
+        """
+        if pattern != self.pattern:
+            self.levels[:] = bytes(self.high if pattern[i >> 3] & (0x80 >> (i & 7)) else self.low for i in range(128))
+            self.pattern = bytes(pattern)
+        step = 4000 * 2 ** ((pitch - 64) / 48) / SAMPLE_RATE
+        block = self.block
+        levels = self.levels
+        phase = self.pattern_phase
+        for i in range(FRAME_SAMPLES):
+            block[i] = levels[int(phase) & 127]
+            phase += step
+        self.pattern_phase = phase % 128
+
+
+class StreamingAudio(object):
+    """
+    Feeds the buzzer to a sink a frame at a time
+    """
+
+    def __init__(self, sink, generator=None) -> None:
+        super().__init__()
+        self.sink = sink
+        self.generator = generator or ToneGenerator()
+
+    def tick(self, c8):
+        """
+        Called by the core once per 60 Hz timer tick, before the sound timer counts down
+        :param c8:
+        """
+        self.sink.write(self.generator.render(c8))
+
+
+class NullSink(object):
+    """Throws the audio away, for headless runs."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.frames = 0
+
+    def write(self, block):
+        """
+        Drops a frame of samples
+        :param block:
+        """
+        self.frames += 1
+
+
+class PygletStream(pyglet.media.StreamingSource):
+    """
+    Plays the frames written to it through pyglet. Frames wait in a fixed size ring until the player's thread reads
+    them, the oldest being dropped once it's full so running faster than real time doesn't build up latency.
+    """
+
+    def __init__(self, frames=6) -> None:
+        super().__init__()
+        self.audio_format = pyglet.media.codecs.AudioFormat(channels=1, sample_size=8, sample_rate=SAMPLE_RATE)
+        self.ring = bytearray(FRAME_SAMPLES * frames)
+        self.read = 0
+        self.available = 0
+        self.timestamp = 0.0
+        self.lock = threading.Lock()
+        self.player = None
+
+    def start(self):
+        """
+        Starts playing the stream
+        """
+        self.player = self.play()
+
+    def write(self, block):
+        """
+        Copies a frame of samples into the ring
+        :param block:
+        """
+        ring = self.ring
+        size = len(ring)
+        length = len(block)
+        with self.lock:
+            if self.available + length > size:
+                # drop the oldest samples rather than fall further behind
+                dropped = self.available + length - size
+                self.read = (self.read + dropped) % size
+                self.available -= dropped
+            start = (self.read + self.available) % size
+            first = min(length, size - start)
+            ring[start:start + first] = block[:first]
+            ring[:length - first] = block[first:]
+            self.available += length
+
+    def get_audio_data(self, num_bytes, compensation_time=0.0):
+        """
+        Hands the player the samples written so far, silence while there are none so the stream never ends
+        :param num_bytes:
+        :param compensation_time:
+        :return: AudioData
+        """
+        ring = self.ring
+        size = len(ring)
+        with self.lock:
+            length = min(num_bytes, self.available)
+            if length:
+                first = min(length, size - self.read)
+                data = bytes(ring[self.read:self.read + first]) + bytes(ring[:length - first])
+                self.read = (self.read + length) % size
+                self.available -= length
+            else:
+                length = min(num_bytes, FRAME_SAMPLES)
+                data = bytes([SILENCE]) * length
+        duration = length / SAMPLE_RATE
+        audio_data = pyglet.media.codecs.AudioData(data, length, self.timestamp, duration, [])
+        self.timestamp += duration
+        return audio_data
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Runs many roms, seeds and input scripts headlessly across a process pool.
+
+    python batch.py [--seeds 0 1 ...] [--cycles N] [--inputs script] [--engine interpreter|jit] [--quirks PROFILE]
+                    [--workers N] rom ...
+
+Every rom is run once per seed and a JSON line is printed for each run as it finishes.
+
+An input script is a text file of "<cycle> <key> <down|up>" lines, the key being a hex chip8 key (0-F). Blank lines
+and anything after a # are ignored.
+"""
+import argparse
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+from chip8 import Chip8
+from jit import JitChip8
+from quirks import PROFILES, quirk_class
+
+ENGINES = {
+    'interpreter': Chip8,
+    'jit': JitChip8,
+}
+
+
+@dataclass
+class Job:
+    """Class for keeping track of one headless run."""
+    rom: str = ''
+    seed: int = 0
+    cycles: int = 100000
+    inputs: List[Tuple[int, int, bool]] = field(default_factory=list)
+    engine: str = 'interpreter'
+    # quirk profile to run with, see quirks.py, None for the core's own behaviour
+    quirks: str = None
+
+
+def parse_inputs(text):
+    """
+    Parses an input script into a list of (cycle, key, pressed) events sorted by cycle
+    :param text:
+    :return: list of events
+    """
+    events = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        try:
+            cycle, chip8_key, state = line.split()
+            events.append((int(cycle), int(chip8_key, 16), {'down': True, 'up': False}[state]))
+        except (ValueError, KeyError):
+            raise ValueError(f'Bad input script line {number}: {line!r}')
+    return sorted(events, key=lambda event: event[0])
+
+
+def run_job(job):
+    """
+    Runs a job to its cycle budget, feeding in its inputs at their cycles.
+    Stops early if the cpu halts on Fx0A with no input left to wake it.
+    :param job:
+    :return: dict of results
+    """
+    c8 = None
+    events = list(job.inputs)
+    error = None
+    try:
+        cls = ENGINES[job.engine]
+        if job.quirks is not None:
+            cls = quirk_class(cls, job.quirks)
+        c8 = cls(seed=job.seed)
+        c8.load_rom(job.rom)
+        while c8.cycle_count < job.cycles:
+            while events and events[0][0] <= c8.cycle_count:
+                _, chip8_key, pressed = events.pop(0)
+                if pressed:
+                    c8.key_press(chip8_key)
+                else:
+                    c8.key_release(chip8_key)
+            until = min(events[0][0], job.cycles) if events else job.cycles
+            c8.run_until(cycles=until - c8.cycle_count)
+            if c8.key_wait is not None and not events:
+                break
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return job_result(job, c8, error)
+
+
+def job_result(job, c8, error=None):
+    """
+    Builds the result of a job from the machine it ran on
+    :param job:
+    :param c8: the machine, None when the job failed before one was set up, leaving its fields None
+    :param error: what stopped the run early, if anything
+    :return: dict of results
+    """
+    return {
+        'rom': str(job.rom),
+        'seed': job.seed,
+        'engine': job.engine,
+        'quirks': job.quirks,
+        'cycles': c8.cycle_count if c8 is not None else None,
+        'pc': c8.pc if c8 is not None else None,
+        'index_register': c8.index_register if c8 is not None else None,
+        'registers': list(c8.registers) if c8 is not None else None,
+        'waiting_for_key': c8.key_wait is not None if c8 is not None else None,
+        'framebuffer_sha1': hashlib.sha1(c8.framebuffer()).hexdigest() if c8 is not None else None,
+        'error': error,
+    }
+
+
+def run_batch(jobs, workers=None):
+    """
+    Fans jobs out over a process pool, yielding each result as soon as it is ready. A job whose worker fails is
+    reported with the failure as its error rather than ending the batch.
+    :param jobs:
+    :param workers: pool size, defaults to the cpu count
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = job_result(futures[future], None, f'{type(e).__name__}: {e}')
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run chip8 roms headlessly in parallel')
+    parser.add_argument('roms', nargs='+', type=Path, help='roms to run')
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0], help='seeds for rnd, each rom is run once per seed')
+    parser.add_argument('--cycles', type=int, default=100000, help='cycle budget per run')
+    parser.add_argument('--inputs', type=Path, help='input script fed to every run')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='interpreter', help='execution engine')
+    parser.add_argument('--quirks', choices=sorted(PROFILES), help="quirk profile, defaults to the core's own behaviour")
+    parser.add_argument('--workers', type=int, help='worker processes, defaults to the cpu count')
+    args = parser.parse_args()
+
+    inputs = parse_inputs(args.inputs.read_text()) if args.inputs else []
+    jobs = [Job(rom=str(rom), seed=seed, cycles=args.cycles, inputs=inputs, engine=args.engine,
+                quirks=args.quirks)
+            for rom in args.roms for seed in args.seeds]
+    for result in run_batch(jobs, args.workers):
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the headless Chip8 core.
+
+    python benchmark.py [--cycles N] [--engine NAME ...] [--renderer shape|texture] [--json FILE] [--baseline FILE] [rom ...]
+
+Runs each rom (every *.rom in games/ by default) for a fixed number of cycles on every engine and reports
+instructions per second and the time one 60 Hz frame of cpu work takes. Machines run frame by frame through
+run_frame, as MainGame, batch and movie replay drive them, with the figure for a single flat out execute call
+alongside. A second, instrumented interpreter run splits the time between instruction lookup, the opcode handlers,
+draw, set_grid_colors and render. The report can be written as JSON and compared against an earlier one to track
+regressions in the cycle hot path.
+"""
+import argparse
+import hashlib
+import json
+import platform
+import time
+from pathlib import Path
+
+from batch import ENGINES
+from chip8 import Chip8
+
+# sections of the hot path the profiled run times separately
+SECTIONS = ('get_instruction', 'handlers', 'draw', 'set_grid_colors', 'render')
+# changes in instructions per second against the baseline smaller than this are reported as noise
+REGRESSION_THRESHOLD = 0.05
+
+
+class ProfiledChip8(Chip8):
+    """
+    Chip8 timing each section of the cycle hot path. The timer calls make it several times slower than the plain
+    core, so only the split between sections is meaningful, not the totals.
+    """
+
+    def __init__(self, scale=10, seed=None) -> None:
+        super().__init__(scale, seed)
+        # section -> [seconds, calls]
+        self.timings = {section: [0.0, 0] for section in SECTIONS}
+
+    def cycle(self, force=False):
+        """
+        Runs one instruction, timing the fetch and decode table lookup apart from the handler
+        """
+        if not self.is_paused or force:
+            timings = self.timings
+            start = time.perf_counter()
+            run, operands, self.opcode = self.decode_table[self.memory[self.pc] << 8 | self.memory[self.pc + 1]]
+            self.sample_instructions.append(self.opcode)
+            decoded = time.perf_counter()
+            run(self, *operands)
+            self.pc += 2
+            end = time.perf_counter()
+            timings['get_instruction'][0] += decoded - start
+            timings['get_instruction'][1] += 1
+            timings['handlers'][0] += end - decoded
+            timings['handlers'][1] += 1
+
+    def draw(self, vx, vy, sprite):
+        """
+        Draws the sprite, timing it apart from the rest of the drw handler
+        """
+        start = time.perf_counter()
+        collision = super().draw(vx, vy, sprite)
+        self.timings['draw'][0] += time.perf_counter() - start
+        self.timings['draw'][1] += 1
+        return collision
+
+    def set_grid_colors(self):
+        """
+        Repaints the renderer, timing it
+        """
+        start = time.perf_counter()
+        super().set_grid_colors()
+        self.timings['set_grid_colors'][0] += time.perf_counter() - start
+        self.timings['set_grid_colors'][1] += 1
+
+    def render(self):
+        """
+        Renders the grid, timing it
+        """
+        start = time.perf_counter()
+        super().render()
+        self.timings['render'][0] += time.perf_counter() - start
+        self.timings['render'][1] += 1
+
+
+def run_frames(c8, cycles):
+    """
+    Runs whole 60 Hz frames until cycles instructions have run or the cpu halts on Fx0A
+    :param c8:
+    :param cycles:
+    :return: number of instructions run, counted to the end of the frame the cpu halted in
+    """
+    while c8.cycle_count < cycles and c8.key_wait is None:
+        c8.run_frame()
+    return c8.cycle_count
+
+
+def bench_rom(path_to_rom, cycles, seed=0, engine='interpreter', repeat=1):
+    """
+    Runs a rom headlessly for a number of cycles, keeping the fastest of repeat runs, both frame by frame and as one
+    execute call. A rom halting on Fx0A stops the run early, only the instructions executed are counted.
+    :param path_to_rom:
+    :param cycles:
+    :param seed: seed for rnd so runs are comparable
+    :param engine: key into ENGINES
+    :param repeat: number of runs, each on a freshly loaded machine
+    :return: dict of the run's timings
+    """
+    best = {}
+    ran = {}
+    # the machine each way of running ended on
+    machines = {}
+    for _ in range(repeat):
+        for mode, run in (('frames', run_frames), ('execute', lambda c8, count: c8.execute(count))):
+            c8 = machines[mode] = ENGINES[engine](seed=seed)
+            c8.load_rom(path_to_rom)
+            start = time.perf_counter()
+            ran[mode] = run(c8, cycles)
+            elapsed = time.perf_counter() - start
+            best[mode] = min(best.get(mode, elapsed), elapsed)
+    frames = machines['frames']
+    return {
+        'instructions': ran['frames'],
+        'halted': frames.key_wait is not None,
+        'cycles_per_frame': frames.cycles_per_frame,
+        'seconds': best['frames'],
+        'instructions_per_second': ran['frames'] / best['frames'],
+        # wall time to emulate one 60 Hz frame of cpu work at the default clock, 16.7 ms being real time
+        'frame_time_ms': best['frames'] / ran['frames'] * frames.cycles_per_frame * 1000,
+        'execute_instructions': ran['execute'],
+        'execute_halted': machines['execute'].key_wait is not None,
+        'execute_seconds': best['execute'],
+        'execute_instructions_per_second': ran['execute'] / best['execute'],
+    }
+
+
+def profile_rom(path_to_rom, cycles, seed=0, renderer_class=None):
+    """
+    Runs a rom frame by frame on the instrumented interpreter, rendering after every frame like MainGame does, until
+    cycles instructions have run or the cpu halts on Fx0A
+    :param path_to_rom:
+    :param cycles:
+    :param seed: seed for rnd so runs are comparable
+    :param renderer_class: renderer to attach, without one set_grid_colors and render are left out of the report
+    :return: dict of section -> {'seconds', 'calls', 'share'}
+    """
+    c8 = ProfiledChip8(seed=seed)
+    if renderer_class is not None:
+        c8.attach_renderer(renderer_class(c8, c8.scale))
+    c8.load_rom(path_to_rom)
+    # once up front, the same full repaint a color change costs
+    c8.set_grid_colors()
+    while c8.cycle_count < cycles and c8.key_wait is None:
+        c8.run_frame()
+        c8.render()
+    timings = c8.timings
+    # drw's time includes the draw it calls, keep the handlers figure to everything else
+    timings['handlers'][0] -= timings['draw'][0]
+    if renderer_class is None:
+        # with nothing attached they only time an empty call
+        del timings['set_grid_colors'], timings['render']
+    total = sum(seconds for seconds, _ in timings.values()) or 1.0
+    return {section: {'seconds': seconds, 'calls': calls, 'share': seconds / total}
+            for section, (seconds, calls) in timings.items()}
+
+
+def open_renderer(name):
+    """
+    Opens a hidden window to give a renderer a GL context
+    :param name: 'shape' or 'texture'
+    :return: (window, renderer class), the window must be kept open while the renderer is used
+    """
+    import pyglet
+    from renderer import ShapeRenderer, TextureRenderer
+
+    window = pyglet.window.Window(visible=False)
+    return window, {'shape': ShapeRenderer, 'texture': TextureRenderer}[name]
+
+
+def compare(report, baseline):
+    """
+    Lists the change in instructions per second of every rom and engine in both reports
+    :param report:
+    :param baseline: an earlier report
+    :return: list of (rom, engine, relative change)
+    """
+    before = {(rom['rom'], engine): result['instructions_per_second']
+              for rom in baseline['roms'] for engine, result in rom['engines'].items()}
+    changes = []
+    for rom in report['roms']:
+        for engine, result in rom['engines'].items():
+            if (rom['rom'], engine) in before:
+                changes.append((rom['rom'], engine, result['instructions_per_second'] / before[rom['rom'], engine] - 1))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chip8 interpreter benchmark')
+    parser.add_argument('roms', nargs='*', type=Path, help='roms to run, defaults to games/*.rom')
+    parser.add_argument('--cycles', type=int, default=100000, help='cycles to run per rom')
+    parser.add_argument('--seed', type=int, default=0, help='seed for rnd')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per rom and engine, the fastest is reported')
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES), dest='engines',
+                        help='execution engine to measure, may be given more than once, defaults to all')
+    parser.add_argument('--renderer', choices=['shape', 'texture'], help='renderer to time render with, needs a display')
+    parser.add_argument('--no-profile', action='store_true', help='skip the instrumented per section run')
+    parser.add_argument('--json', type=Path, help='write the report to this file')
+    parser.add_argument('--baseline', type=Path, help='earlier --json report to compare against')
+    args = parser.parse_args()
+
+    roms = args.roms or sorted(Path('games').glob('*.rom'))
+    if not roms:
+        parser.error('no roms found, pass rom paths or add some to games/')
+    engines = args.engines or sorted(ENGINES)
+    window, renderer_class = open_renderer(args.renderer) if args.renderer else (None, None)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'cycles': args.cycles,
+        'seed': args.seed,
+        'renderer': args.renderer,
+        'roms': [],
+    }
+    for rom in roms:
+        result = {
+            'rom': rom.name,
+            'sha1': hashlib.sha1(rom.read_bytes()).hexdigest(),
+            'engines': {engine: bench_rom(rom, args.cycles, args.seed, engine, args.repeat) for engine in engines},
+        }
+        for engine, timing in result['engines'].items():
+            print(f'{rom.name:<24} {engine:<12} {timing["instructions_per_second"]:>12,.0f} instr/s '
+                  f'{timing["frame_time_ms"]:>8.3f} ms/frame {timing["execute_instructions_per_second"]:>12,.0f} instr/s '
+                  f'in one execute' + ('  (halted on Fx0A)' if timing['halted'] else ''))
+        if not args.no_profile:
+            result['profile'] = profile_rom(rom, args.cycles, args.seed, renderer_class)
+            print('    ' + '  '.join(f'{section} {timing["share"]:.0%}' for section, timing in result['profile'].items()))
+        report['roms'].append(result)
+
+    if window is not None:
+        window.close()
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        for rom, engine, change in compare(report, json.loads(args.baseline.read_text())):
+            verdict = 'regressed' if change < -REGRESSION_THRESHOLD else 'improved' if change > REGRESSION_THRESHOLD else 'same'
+            print(f'{rom:<24} {engine:<12} {change:>+8.1%} {verdict}')
+
+
+if __name__ == "__main__":
+    main()
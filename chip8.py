@@ -1,11 +1,12 @@
 import math
 import random
+import struct
 from collections import deque
 from dataclasses import dataclass
-from typing import Callable
-import pyglet
-from pyglet import shapes
-from pyglet.window import key
+
+from hooks import HOOK_EVENTS, INSTRUCTION_EVENTS, hooked_cycle, hooked_draw, hooked_tick_timers
+from profiler import Profiler
+from tracelog import TraceWriter
 
 
 @dataclass
@@ -14,17 +15,131 @@ class OpCode:
     bytecode: int = 0
     asm: str = ''
     desc: str = ''
-    run: Callable = None
+    handler: str = ''
+    mask: int = 0xF000
+    operands: str = ''
+
+
+INSTRUCTIONS = [
+    OpCode(bytecode=0x00E0, asm="CLS", desc="Clear the display.", handler='cls', mask=0xFFFF),
+    OpCode(bytecode=0x00EE, asm="RET", desc="Return from a subroutine.", handler='ret', mask=0xFFFF),
+    OpCode(bytecode=0x1000, asm="JP addr", desc="Jump to location nnn.", handler='jp', operands='nnn'),
+    OpCode(bytecode=0x2000, asm="CALL addr", desc="Call subroutine at nnn.", handler='call', operands='nnn'),
+    OpCode(bytecode=0x3000, asm="SE Vx, byte", desc="Skip instruction if Vx = kk.", handler='se', operands='xkk'),
+    OpCode(bytecode=0x4000, asm="SNE Vx, byte", desc="Skip instruction if Vx != kk", handler='sne', operands='xkk'),
+    OpCode(bytecode=0x5000, asm="SE Vx, Vy", desc="Skip instruction if Vx = Vy", handler='se2', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x6000, asm="LD Vx, byte", desc="Puts value kk into register Vx", handler='ld', operands='xkk'),
+    OpCode(bytecode=0x7000, asm="ADD Vx, byte", desc="Set Vx = Vx + kk.", handler='add', operands='xkk'),
+    OpCode(bytecode=0x8000, asm="LD Vx, Vy", desc="Set Vx = Vy.", handler='ld2', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8001, asm="OR Vx, Vy", desc="Set Vx = Vx OR Vy.", handler='OR', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8002, asm="AND Vx, Vy", desc="Set Vx = Vx AND Vy.", handler='AND', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8003, asm="XOR Vx, Vy", desc="Set Vx = Vx XOR Vy.", handler='XOR', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8004, asm="ADD Vx, Vy", desc="Set Vx = Vx + Vy, set VF = carry.", handler='add2', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8005, asm="SUB Vx, Vy", desc="Set Vx = Vx - Vy, set VF = NOT borrow.", handler='sub', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8006, asm="SHR Vx {, Vy}", desc="Set Vx = Vx SHR 1.", handler='shr', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x8007, asm="SUBN Vx, Vy", desc="Set Vx = Vy - Vx", handler='subn', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x800E, asm="SHL Vx {, Vy}", desc="Set Vx = Vx SHL 1.", handler='shl', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x9000, asm="SNE Vx, Vy", desc="Skip instruction if Vx != Vy.", handler='sne2', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0xA000, asm="LD I, addr", desc="Set I = nnn.", handler='ld3', operands='nnn'),
+    OpCode(bytecode=0xB000, asm="JP V0, addr", desc="Jump to location nnn + V0.", handler='jp2', operands='nnn'),
+    OpCode(bytecode=0xC000, asm="RND Vx, byte", desc="Set Vx = random byte AND kk.", handler='rnd', operands='xkk'),
+    OpCode(bytecode=0xD000, asm="DRW Vx, Vy, nibble", desc="Display n-byte sprite", handler='drw', operands='xyn'),
+    OpCode(bytecode=0xE09E, asm="SKP Vx", desc="Skip instruction if key in Vx is pressed", handler='skp', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xE0A1, asm="SKNP Vx", desc="Skip instruction if key in Vx is not pressed", handler='sknp', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF007, asm="LD Vx, DT", desc="Set Vx = delay timer value.", handler='ld4', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF00A, asm="LD Vx, K", desc="Wait for a key press, store key in Vx.", handler='ld5', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF015, asm="LD DT, Vx", desc="Set delay timer = Vx.", handler='ld6', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF018, asm="LD ST, Vx", desc="Set sound timer = Vx.", handler='ld7', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF01E, asm="ADD I, Vx", desc="Set I = I + Vx.", handler='add3', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF029, asm="LD F, Vx", desc="Set I = location of sprite for digit Vx.", handler='ld8', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF033, asm="LD B, Vx", desc="Store BCD representation of Vx in memory locations I, I+1, and I+2.", handler='ld9', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF055, asm="LD [I], Vx", desc="Store registers V0 through Vx in memory starting at location I.", handler='ld10', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF065, asm="LD Vx, [I]", desc="Read registers V0 through Vx from memory starting at location I.", handler='ld11', mask=0xF0FF, operands='x'),
+]
+
+UNKNOWN = OpCode(asm="Unknown", desc="Unknown opcode.", handler='unknown', mask=0xFFFF, operands='opcode')
+
+
+def decode_operands(opcode, operands):
+    """
+    Extracts the operand values an instruction handler takes from a raw opcode
+    :param opcode:
+    :param operands: one of '', 'nnn', 'xkk', 'xy', 'xyn', 'x', 'n' or 'opcode'
+    :return: tuple of operands
+    """
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    return {
+        '': (),
+        'nnn': (opcode & 0x0FFF,),
+        'xkk': (x, opcode & 0x00FF),
+        'xy': (x, y),
+        'xyn': (x, y, opcode & 0x000F),
+        'x': (x,),
+        'n': (opcode & 0x000F,),
+        'opcode': (opcode,),
+    }[operands]
+
+
+_decode_tables = {}
+
+# Fx33's hundreds, tens and ones digits for every register value
+BCD_TABLE = tuple(bytes((value // 100, value // 10 % 10, value % 10)) for value in range(256))
+
+# save state layout: magic, version, pc, I, delay timer, sound timer, key wait register (-1 for none), stack depth,
+# pressed keys bitmask, cycles per frame, frame cycles, cycle count. Followed by the 16 registers, 16 stack slots,
+# memory and the bit-packed framebuffer
+STATE_MAGIC = b'C8ST'
+STATE_VERSION = 1
+STATE_HEADER = struct.Struct('<4sBHHBBbBHHHQ')
+STATE_STACK = struct.Struct('<16H')
+
+
+def build_decode_table(cls):
+    """
+    Builds (once per class) a table indexed by the full 16 bit opcode holding the handler function,
+    its pre-extracted operands and the OpCode it was decoded from
+    :param cls: Chip8 or a subclass overriding instruction handlers or adding to its instructions. Later
+    instructions take over the opcodes they share with earlier ones.
+    :return: list of 65536 (handler, operands, OpCode) tuples
+    """
+    table = _decode_tables.get(cls)
+    if table is None:
+        unknown = getattr(cls, UNKNOWN.handler)
+        table = [(unknown, (opcode,), UNKNOWN) for opcode in range(0x10000)]
+        for op in cls.instructions:
+            run = getattr(cls, op.handler)
+            free = ~op.mask & 0xFFFF
+            # walk every opcode matching this instruction by enumerating the unmasked bits
+            opcode = op.bytecode
+            while True:
+                table[opcode] = (run, decode_operands(opcode, op.operands), op)
+                if opcode & free == free:
+                    break
+                opcode = (((opcode | op.mask) + 1) & free) | op.bytecode
+        _decode_tables[cls] = table
+    return table
 
 
 class Chip8(object):
-    def __init__(self, scale) -> None:
+    # instruction set the decode table is built from
+    instructions = INSTRUCTIONS
+    memory_size = 4096
+    # quirk profile the handlers were specialized for, see quirks.py
+    quirks = None
+    # 128 one bit samples the buzzer plays, None for the plain tone, see XoChip8
+    audio_pattern = None
+
+    def __init__(self, scale=10, seed=None) -> None:
         super().__init__()
+        # rnd draws from a per machine generator so a seeded run is reproducible
+        self.seed = seed
+        self.random = random.Random(seed)
         self.width = 64
         self.height = 32
         self.scale = scale
         self.rom_pointer = 512
-        self.memory = bytearray(4096)
+        self.memory = bytearray(self.memory_size)
         # 0x050-0x0A0 - Used for the built in 4x5 pixel font set (0-F) (80 bytes)
         # We put it into the memory starting from the address 0x0 which is easier for us,
         # but it could be anywhere between 0x00 and 0x1FF because those memory cells are
@@ -49,402 +164,474 @@ class Chip8(object):
         ]
         self.pc = 0x200  # Program counter starts at 0x200
         self.opcode = 0  # Reset current opcode
-        self.index_register = bytearray(0)  # Reset index register
-        self.registers = [0 for x in range(16)]
-        self.stack = []
-        self.instructions = {
-            0x0000: {
-                0x00E0: OpCode(bytecode=0x00E0, asm="CLS", desc="Clear the display.", run=self.cls),
-                0x00EE: OpCode(bytecode=0x00EE, asm="RET", desc="Return from a subroutine.", run=self.ret)
-            },
-            0x1000: OpCode(bytecode=0x1000, asm="JP addr", desc="Jump to location nnn.", run=self.jp),
-            0x2000: OpCode(bytecode=0x2000, asm="CALL addr", desc="Call subroutine at nnn.", run=self.call),
-            0x3000: OpCode(bytecode=0x3000, asm="SE Vx, byte", desc="Skip instruction if Vx = kk.", run=self.se),
-            0x4000: OpCode(bytecode=0x4000, asm="SNE Vx, byte", desc="Skip instruction if Vx != kk", run=self.sne),
-            0x5000: OpCode(bytecode=0x5000, asm="SE Vx, Vy", desc="Skip instruction if Vx = Vy", run=self.se2),
-            0x6000: OpCode(bytecode=0x6000, asm="LD Vx, byte", desc="Puts value kk into register Vx", run=self.ld),
-            0x7000: OpCode(bytecode=0x7000, asm="ADD Vx, byte", desc="Set Vx = Vx + kk.", run=self.add),
-            0x8000: {
-                0x8000: OpCode(bytecode=0x8000, asm="LD Vx, Vy", desc="Set Vx = Vy.", run=self.ld2),
-                0x8001: OpCode(bytecode=0x8001, asm="OR Vx, Vy", desc="Set Vx = Vx OR Vy.", run=self.OR),
-                0x8002: OpCode(bytecode=0x8002, asm="AND Vx, Vy", desc="Set Vx = Vx AND Vy.", run=self.AND),
-                0x8003: OpCode(bytecode=0x8003, asm="XOR Vx, Vy", desc="Set Vx = Vx XOR Vy.", run=self.XOR),
-                0x8004: OpCode(bytecode=0x8004, asm="ADD Vx, Vy", desc="Set Vx = Vx + Vy, set VF = carry.", run=self.add2),
-                0x8005: OpCode(bytecode=0x8005, asm="SUB Vx, Vy", desc="Set Vx = Vx - Vy, set VF = NOT borrow.", run=self.sub),
-                0x8006: OpCode(bytecode=0x8006, asm="SHR Vx {, Vy}", desc="Set Vx = Vx SHR 1.", run=self.shr),
-                0x8007: OpCode(bytecode=0x8007, asm="SUBN Vx, Vy", desc="Set Vx = Vy - Vx", run=self.subn),
-                0x800E: OpCode(bytecode=0x800E, asm="SHL Vx {, Vy}", desc="Set Vx = Vx SHL 1.", run=self.shl)
-            },
-            0x9000: OpCode(bytecode=0x9000, asm="SNE Vx, Vy", desc="Skip instruction if Vx != Vy.", run=self.sne2),
-            0xA000: OpCode(bytecode=0xA000, asm="LD I, addr", desc="Set I = nnn.", run=self.ld3),
-            0xB000: OpCode(bytecode=0xB000, asm="JP V0, addr", desc="Jump to location nnn + V0.", run=self.jp2),
-            0xC000: OpCode(bytecode=0xC000, asm="RND Vx, byte", desc="Set Vx = random byte AND kk.", run=self.rnd),
-            0xD000: OpCode(bytecode=0xD000, asm="DRW Vx, Vy, nibble", desc="Display n-byte sprite", run=self.drw),
-            0xE000: {
-                0xE09E: OpCode(bytecode=0xE09E, asm="SKP Vx", desc="Skip instruction if key in Vx is pressed", run=self.skp),
-                0xE0A1: OpCode(bytecode=0xE0A1, asm="SKNP Vx", desc="Skip instruction if key in Vx is not pressed", run=self.sknp)
-            },
-            0xF000: {
-                0xF007: OpCode(bytecode=0xF007, asm="LD Vx, DT", desc="Set Vx = delay timer value.", run=self.ld4),
-                0xF00A: OpCode(bytecode=0xF00A, asm="LD Vx, K", desc="Wait for a key press, store key in Vx.", run=self.ld5),
-                0xF015: OpCode(bytecode=0xF015, asm="LD DT, Vx", desc="Set delay timer = Vx.", run=self.ld6),
-                0xF018: OpCode(bytecode=0xF018, asm="LD ST, Vx", desc="Set sound timer = Vx.", run=self.ld7),
-                0xF01E: OpCode(bytecode=0xF01E, asm="ADD I, Vx", desc="Set I = I + Vx.", run=self.add3),
-                0xF029: OpCode(bytecode=0xF029, asm="LD F, Vx", desc="Set I = location of sprite for digit Vx.", run=self.ld8),
-                0xF033: OpCode(bytecode=0xF033, asm="LD B, Vx", desc="Store BCD representation of Vx in memory locations I, I+1, and I+2.", run=self.ld9),
-                0xF055: OpCode(bytecode=0xF055, asm="LD [I], Vx", desc="Store registers V0 through Vx in memory starting at location I.", run=self.ld10),
-                0xF065: OpCode(bytecode=0xF065, asm="LD Vx, [I]", desc="Read registers V0 through Vx from memory starting at location I.", run=self.ld11)
-            }
-        }
-        self.grid = []
-        for i in range(32):
-            line = []
-            for j in range(64):
-                line.append(0)
-            self.grid.append(line)
-        self.emptyGrid = self.grid[:]
+        self.index_register = 0  # Reset index register
+        # V0-VF, a bytearray so every register stays 8 bits wide
+        self.registers = bytearray(16)
+        # zero copy windows for the bulk opcodes, they also pin both buffers' size so a slice assignment running off
+        # the end of memory raises instead of resizing them
+        self.memory_view = memoryview(self.memory)
+        self.register_view = memoryview(self.registers)
+        # return addresses, sp being the number in use
+        self.stack = [0] * 16
+        self.sp = 0
+        self.decode_table = build_decode_table(type(self))
+        # each row of the display is packed into one int, the leftmost pixel being the most significant bit
+        self.grid = [0] * self.height
+        # bit-planes making up the display, a pixel's color being indexed by its bit in each, see colors
+        self.planes = [self.grid]
         self.on_color = [255, 255, 255]
         self.off_color = [0, 0, 0]
-        # creating a batch object
-        self.batch = pyglet.graphics.Batch()
-        self.shape_grid = []
-        for i in range(len(self.grid)):
-            shape_line = []
-            for j in range(len(self.grid[i])):
-                shape_line.append(shapes.Rectangle((j * self.scale) + 10, ((32 * 20) - (i * self.scale)) - 20, self.scale, self.scale, color=self.off_color, batch=self.batch))
-            self.shape_grid.append(shape_line)
-        self.pc_key_map = {
-            key._1: 1,
-            key._2: 2,
-            key._3: 3,
-            key._4: 0xc,
-            key.Q: 4,
-            key.W: 5,
-            key.E: 6,
-            key.R: 0xd,
-            key.A: 7,
-            key.S: 8,
-            key.D: 9,
-            key.F: 0xe,
-            key.Z: 0xa,
-            key.X: 0,
-            key.C: 0xb,
-            key.V: 0xf
-        }
+        # frontends are optional, a headless core never touches pyglet
+        self.renderer = None
+        self.audio = None
         self.keyboard_keys = []
         for i in range(0, 16):
             self.keyboard_keys.append(False)
         self.is_paused = False
-        self.sample_instructions = deque()
         self.sample_instructions_size = 12
+        self.sample_instructions = deque(maxlen=self.sample_instructions_size + 1)
         self.delay_timer = 0
         self.sound_timer = 0
-        self.audio = pyglet.resource.media('audio.wav', streaming=False)
+        # instructions executed per 60 Hz timer tick
+        self.cycles_per_frame = 8
+        # instructions executed so far in the current frame and in total
+        self.frame_cycles = 0
+        self.cycle_count = 0
+        # register Fx0A is waiting to store a key press in, None while the cpu is running
+        self.key_wait = None
+        # execution profile, kept after profiling stops until it is cleared
+        self.profiler = None
+        self.is_profiling = False
+        # open execution trace, see tracelog.py
+        self.tracer = None
+        # event -> callbacks, see hooks.py
+        self.hooks = {event: [] for event in HOOK_EVENTS}
+
+    @property
+    def instructions_per_second(self):
+        """
+        CPU clock speed, the timers always tick at 60 Hz of emulated time
+        """
+        return self.cycles_per_frame * 60
+
+    @instructions_per_second.setter
+    def instructions_per_second(self, value):
+        self.cycles_per_frame = max(1, round(value / 60))
+
+    @property
+    def is_instrumented(self):
+        """
+        True while a profiled, traced or hooked cycle is swapped in, engines that don't go through cycle fall back to it
+        """
+        return 'cycle' in self.__dict__
+
+    def start_profiling(self):
+        """
+        Swaps in a cycle that counts executions and wall time per instruction class and pc address.
+        Data collected by an earlier run carries on being added to.
+        :return: Profiler
+        """
+        if self.profiler is None:
+            self.profiler = Profiler()
+        self.is_profiling = True
+        self.update_dispatch()
+        return self.profiler
+
+    def stop_profiling(self):
+        """
+        Goes back to the plain cycle, the collected data stays in self.profiler
+        """
+        self.is_profiling = False
+        self.update_dispatch()
+
+    def start_tracing(self, path, buffer_records=65536):
+        """
+        Swaps in a cycle that streams a record of every instruction executed to a binary trace file
+        :param path:
+        :param buffer_records: records buffered between writes
+        :return: TraceWriter
+        """
+        self.stop_tracing()
+        self.tracer = TraceWriter(path, buffer_records)
+        self.update_dispatch()
+        return self.tracer
+
+    def stop_tracing(self):
+        """
+        Goes back to the plain cycle, flushing and closing the trace file
+        """
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
+            self.update_dispatch()
+
+    def add_hook(self, event, callback):
+        """
+        Registers a callback for one of hooks.HOOK_EVENTS, swapping in the hooked path it needs
+        :param event:
+        :param callback:
+        """
+        if event not in self.hooks:
+            raise ValueError(f'Unknown hook event {event}, expected one of {", ".join(HOOK_EVENTS)}')
+        self.hooks[event].append(callback)
+        self.update_dispatch()
+
+    def remove_hook(self, event, callback):
+        """
+        Unregisters a callback, going back to the plain path once nothing needs the hooked one
+        :param event:
+        :param callback:
+        """
+        self.hooks[event].remove(callback)
+        self.update_dispatch()
+
+    def update_dispatch(self):
+        """
+        Swaps the profiled, traced and hooked wrappers of cycle, draw and tick_timers in or out to match the profiler and the
+        registered hooks. Without either the instance falls through to the plain class methods.
+        """
+        for name in ('cycle', 'draw', 'tick_timers'):
+            self.__dict__.pop(name, None)
+        hooks = self.hooks
+        hook_instructions = any(hooks[event] for event in INSTRUCTION_EVENTS)
+        cycle = self.cycle
+        if self.is_profiling:
+            cycle = self.profiler.wrap(self, cycle)
+        if self.tracer is not None:
+            cycle = self.tracer.wrap(self, cycle)
+        if hook_instructions:
+            cycle = hooked_cycle(self, cycle)
+        if self.is_profiling or self.tracer is not None or hook_instructions:
+            self.cycle = cycle
+        if hooks['draw']:
+            self.draw = hooked_draw(self, self.draw)
+        if hooks['timer']:
+            self.tick_timers = hooked_tick_timers(self, self.tick_timers)
+
+    def attach_renderer(self, renderer):
+        """
+        Attaches a display frontend which picks up grid changes each time it renders
+        :param renderer:
+        """
+        self.renderer = renderer
+
+    def attach_audio(self, audio):
+        """
+        Attaches an audio frontend, its tick is called with the machine on every timer tick to produce that frame's sound
+        :param audio:
+        """
+        self.audio = audio
 
     def reset(self):
         """
         Returns variables to initial state for game reload
         """
-        self.cls(None)
+        self.cls()
         self.pc = 0x200  # Program counter starts at 0x200
         self.opcode = 0  # Reset current opcode
-        self.index_register = bytearray(0)  # Reset index register
-        self.registers = list(map(lambda x: 0, self.registers))
-        self.stack = []
-        self.keyboard_keys = list(map(lambda x: False, self.keyboard_keys))
+        self.index_register = 0  # Reset index register
+        self.registers[:] = bytes(16)
+        self.stack[:] = [0] * 16
+        self.sp = 0
+        self.keyboard_keys[:] = [False] * 16
         self.sample_instructions.clear()
+        self.delay_timer = 0
+        self.sound_timer = 0
+        self.frame_cycles = 0
+        self.cycle_count = 0
+        self.key_wait = None
+        self.random.seed(self.seed)
+
+    def save_state(self):
+        """
+        Captures the machine state as a compact binary blob
+        :return: bytes
+        """
+        keys = sum(1 << i for i, pressed in enumerate(self.keyboard_keys) if pressed)
+        header = STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, self.pc, self.index_register, self.delay_timer,
+                                   self.sound_timer, -1 if self.key_wait is None else self.key_wait, self.sp,
+                                   keys, self.cycles_per_frame, self.frame_cycles, self.cycle_count)
+        stack = STATE_STACK.pack(*self.stack)
+        return b''.join((header, self.registers, stack, self.memory, self.framebuffer()))
+
+    def load_state(self, state):
+        """
+        Restores the machine state from a blob made by save_state
+        :param state:
+        """
+        magic, version, self.pc, self.index_register, self.delay_timer, self.sound_timer, key_wait, self.sp, keys, \
+            self.cycles_per_frame, self.frame_cycles, self.cycle_count = STATE_HEADER.unpack_from(state)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError(f'Not a version {STATE_VERSION} chip8 save state')
+        offset = STATE_HEADER.size
+        self.registers[:] = state[offset:offset + 16]
+        offset += 16
+        self.stack[:] = STATE_STACK.unpack_from(state, offset)
+        offset += STATE_STACK.size
+        self.memory[:] = state[offset:offset + len(self.memory)]
+        offset += len(self.memory)
+        self.load_framebuffer(memoryview(state)[offset:])
+        self.keyboard_keys[:] = [bool(keys >> i & 1) for i in range(16)]
+        self.key_wait = None if key_wait < 0 else key_wait
 
     def get_instruction(self, opcode):
         """
         Takes an opcode and looks up the appropriate instruction
         :param opcode:
-        :return: instruction
+        :return: instruction or None if the opcode is unknown
         """
-        ret = None
-        try:
-            lookup_code = opcode & 0xF000
-            ret = self.instructions[lookup_code]
-            if isinstance(ret, dict):
-                if lookup_code == 0x0000 or lookup_code == 0xE000 or lookup_code == 0xF000:
-                    # last 2 digits match
-                    last = opcode & 0xF0FF
-                    ret = ret[last]
-                elif lookup_code == 0x8000:
-                    # last digit match
-                    last = opcode & 0xF00F
-                    ret = ret[last]
-        except KeyError:
-            print(f'Unknown opcode 0x{opcode:x}')
-        return ret
+        op = self.decode_table[opcode][2]
+        return None if op is UNKNOWN else op
 
-    def key_press(self, symbol):
+    def key_press(self, chip8_key):
         """
-        Takes a computer key char and sets the equivalent chip8 key to true
-        :param symbol:
+        Takes a chip8 key (0x0-0xF) and sets it to pressed, resuming the cpu if it is halted on Fx0A
+        :param chip8_key:
         """
-        if symbol in self.pc_key_map:
-            chip8_key = self.pc_key_map[symbol]
-            self.keyboard_keys[chip8_key] = True
+        self.keyboard_keys[chip8_key] = True
+        if self.key_wait is not None:
+            self.registers[self.key_wait] = chip8_key
+            self.key_wait = None
+            self.pc += 2
 
-    def key_release(self, symbol):
+    def key_release(self, chip8_key):
         """
-        Takes a computer key char and sets the equivalent chip8 key to false
-        :param symbol:
+        Takes a chip8 key (0x0-0xF) and sets it to released
+        :param chip8_key:
         """
-        if symbol in self.pc_key_map:
-            chip8_key = self.pc_key_map[symbol]
-            self.keyboard_keys[chip8_key] = False
+        self.keyboard_keys[chip8_key] = False
 
-    def cls(self, opcode):
+    def cls(self):
         """
         00E0 - CLS, Clear the display.
         """
-        for i in range(len(self.grid)):
-            for j in range(len(self.grid[0])):
-                self.grid[i][j] = 0
-        for i in range(len(self.shape_grid)):
-            for j in range(len(self.shape_grid[i])):
-                self.shape_grid[i][j].color = self.off_color
+        grid = self.grid
+        for i in range(self.height):
+            grid[i] = 0
 
-    def ret(self, opcode):
+    def ret(self):
         """
         00EE - RET, Return from a subroutine.
         The interpreter sets the program counter to the address at the top of the stack & subtracts 1 from stack pointer
         """
-        val = self.stack.pop()
-        self.pc = val
+        if not self.sp:
+            raise ValueError(f'Stack underflow returning from 0x{self.pc:03x}')
+        self.sp -= 1
+        self.pc = self.stack[self.sp]
 
-    def jp(self, opcode):
+    def jp(self, nnn):
         """
         1nnn - JP addr, Jump to location nnn.
         The interpreter sets the program counter to nnn
-        :param opcode:
+        :param nnn:
         """
-        self.pc = (opcode & 0x0FFF) - 2 # sub 2 as we add 2 at end of all ops
+        self.pc = nnn - 2 # sub 2 as we add 2 at end of all ops
 
-    def call(self, opcode):
+    def call(self, nnn):
         """
         2nnn - CALL addr, Call subroutine at nnn.
         The interpreter increments the stack pointer, then puts the current PC on the top of the stack. PC is set to nnn
-        :param opcode:
+        :param nnn:
         """
-        # store in stack too?
-        self.stack.append(self.pc)
-        self.pc = (opcode & 0x0FFF) - 2 # sub 2 as we add 2 at end of all ops
+        if self.sp == len(self.stack):
+            raise ValueError(f'Stack overflow calling 0x{nnn:03x} from 0x{self.pc:03x}')
+        self.stack[self.sp] = self.pc
+        self.sp += 1
+        self.pc = nnn - 2 # sub 2 as we add 2 at end of all ops
 
-    def se(self, opcode):
+    def se(self, vx, kk):
         """
         3xkk - SE Vx, byte, Skip next instruction if Vx = kk.
         The interpreter compares register Vx to kk, and if they are equal, increments the program counter by 2.
-        :param opcode:
+        :param vx:
+        :param kk:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = opcode & 0x00FF
-        if self.registers[vx] == vy:
+        if self.registers[vx] == kk:
             self.pc += 2
 
-    def sne(self, opcode):
+    def sne(self, vx, kk):
         """
         4xkk - SNE Vx, byte, Skip next instruction if Vx != kk.
         The interpreter compares register Vx to kk, and if they are not equal, increments the program counter by 2.
-        :param opcode:
+        :param vx:
+        :param kk:
         """
-        n = (opcode & 0x0F00) >> 8
-        target = opcode & 0x00FF
-        if self.registers[n] != target:
+        if self.registers[vx] != kk:
             self.pc += 2
 
-    def se2(self, opcode):
+    def se2(self, vx, vy):
         """
         5xy0 - SE Vx, Vy, Skip next instruction if Vx = Vy.
         The interpreter compares register Vx to register Vy, and if they are equal, increments the program counter by 2.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
 
         if self.registers[vx] == self.registers[vy]:
             self.pc += 2
 
-    def ld(self, opcode):
+    def ld(self, vx, kk):
         """
         6xkk - LD Vx, byte, Set Vx = kk.
         The interpreter puts the value kk into register Vx.
-        :param opcode:
+        :param vx:
+        :param kk:
         """
-        vx = (opcode & 0x0F00) >> 8
-        nn = opcode & 0x00FF
-        self.registers[vx] = nn
+        self.registers[vx] = kk
 
-    def add(self, opcode):
+    def add(self, vx, kk):
         """
         7xkk - ADD Vx, byte, Set Vx = Vx + kk.
         Adds the value kk to the value of register Vx, then stores the result in Vx.
-        :param opcode:
+        :param vx:
+        :param kk:
         """
-        vx = (opcode & 0x0F00) >> 8
-        kk = opcode & 0x00FF
-        self.registers[vx] = self.registers[vx] + kk
+        self.registers[vx] = (self.registers[vx] + kk) & 0xFF
 
-    def ld2(self, opcode):
+    def ld2(self, vx, vy):
         """
         8xy0 - LD Vx, Vy, Set Vx = Vy.
         Stores the value of register Vy in register Vx.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
         self.registers[vx] = self.registers[vy]
 
-    def OR(self, opcode):
+    def OR(self, vx, vy):
         """
         8xy1 - OR Vx, Vy, Set Vx = Vx OR Vy.
         Performs a bitwise OR on the values of Vx and Vy, then stores the result in Vx.
         A bitwise OR compares the corrseponding bits from two values, and if either bit is 1, then the same bit in the
         result is also 1. Otherwise, it is 0.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
         self.registers[vx] = self.registers[vx] | self.registers[vy]
 
-    def AND(self, opcode):
+    def AND(self, vx, vy):
         """
         8xy2 - AND Vx, Vy, Set Vx = Vx AND Vy.
         Performs a bitwise AND on the values of Vx and Vy, then stores the result in Vx.
         A bitwise AND compares the corrseponding bits from two values, and if both bits are 1,
         then the same bit in the result is also 1. Otherwise, it is 0.
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
         self.registers[vx] = self.registers[vx] & self.registers[vy]
 
-    def XOR(self, opcode):
+    def XOR(self, vx, vy):
         """
         8xy3 - XOR Vx, Vy, Set Vx = Vx XOR Vy.
         Performs a bitwise exclusive OR on the values of Vx and Vy, then stores the result in Vx.
         An exclusive OR compares the corrseponding bits from two values, and if the bits are not both the same,
         then the corresponding bit in the result is set to 1. Otherwise, it is 0.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
         self.registers[vx] = self.registers[vx] ^ self.registers[vy]
 
-    def add2(self, opcode):
+    def add2(self, vx, vy):
         """
         8xy4 - ADD Vx, Vy, Set Vx = Vx + Vy, set VF = carry.
         The values of Vx and Vy are added together. If the result is greater than 8 bits (i.e., > 255,) VF is set to 1,
         otherwise 0. Only the lowest 8 bits of the result are kept, and stored in Vx.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
-        self.registers[0xF] = 0
+        registers = self.registers
+        total = registers[vx] + registers[vy]
+        registers[vx] = total & 0xFF
+        # the flag is written last so it wins when Vx is VF
+        registers[0xF] = total >> 8
 
-        self.registers[vx] += self.registers[vy]
-
-        # catch overflow
-        if self.registers[vx] > 0xFF:
-            self.registers[0xF] = 1
-
-    def sub(self, opcode):
+    def sub(self, vx, vy):
         """
         8xy5 - SUB Vx, Vy, Set Vx = Vx - Vy, set VF = NOT borrow.
-        If Vx > Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted from Vx, and the results stored in Vx.
-        :param opcode:
+        If Vx >= Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted from Vx, and the results stored in Vx.
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
-        self.registers[0xF] = 0
+        registers = self.registers
+        flag = 1 if registers[vx] >= registers[vy] else 0
+        registers[vx] = (registers[vx] - registers[vy]) & 0xFF
+        registers[0xF] = flag
 
-        # catch underflow
-        if self.registers[vx] > self.registers[vy]:
-            self.registers[0xF] = 1
-
-        self.registers[vx] -= self.registers[vy]
-
-    def shr(self, opcode):
+    def shr(self, vx, vy):
         """
         8xy6 - SHR Vx {, Vy}, Set Vx = Vx SHR 1.
         If the least-significant bit of Vx is 1, then VF is set to 1, otherwise 0. Then Vx is divided by 2.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        self.registers[0xF] = self.registers[vx] & 0x1
-        self.registers[vx] >>= 1
+        registers = self.registers
+        flag = registers[vx] & 0x1
+        registers[vx] >>= 1
+        registers[0xF] = flag
 
-    def subn(self, opcode):
+    def subn(self, vx, vy):
         """
         8xy7 - SUBN Vx, Vy, Set Vx = Vy - Vx, set VF = NOT borrow.
-        If Vy > Vx, then VF is set to 1, otherwise 0. Then Vx is subtracted from Vy, and the results stored in Vx.
-        :param opcode:
+        If Vy >= Vx, then VF is set to 1, otherwise 0. Then Vx is subtracted from Vy, and the results stored in Vx.
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
-        self.registers[0xF] = 0
+        registers = self.registers
+        flag = 1 if registers[vy] >= registers[vx] else 0
+        registers[vx] = (registers[vy] - registers[vx]) & 0xFF
+        registers[0xF] = flag
 
-        # catch underflow
-        if self.registers[vx] > self.registers[vy]:
-            self.registers[0xF] = 1
-
-        self.registers[vx] = self.registers[vy] - self.registers[vx]
-
-    def shl(self, opcode):
+    def shl(self, vx, vy):
         """
         8xyE - SHL Vx {, Vy}, Set Vx = Vx SHL 1.
         If the most-significant bit of Vx is 1, then VF is set to 1, otherwise to 0. Then Vx is multiplied by 2.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        self.registers[0xF] = self.registers[vx] & 0x80
-        self.registers[vx] <<= 1
+        registers = self.registers
+        flag = registers[vx] >> 7
+        registers[vx] = (registers[vx] << 1) & 0xFF
+        registers[0xF] = flag
 
-    def sne2(self, opcode):
+    def sne2(self, vx, vy):
         """
         9xy0 - SNE Vx, Vy, Skip next instruction if Vx != Vy.
         The values of Vx and Vy are compared, and if they are not equal, the program counter is increased by 2.
-        :param opcode:
+        :param vx:
+        :param vy:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
 
         if self.registers[vx] != self.registers[vy]:
             self.pc += 2
 
-    def ld3(self, opcode):
+    def ld3(self, nnn):
         """
         Annn - LD I, addr, Set I = nnn.
         The value of register I is set to nnn.
-        :param opcode:
+        :param nnn:
         """
-        addr = opcode & 0x0FFF
-        self.index_register = addr
+        self.index_register = nnn
 
-    def jp2(self, opcode):
+    def jp2(self, nnn):
         """
         Bnnn - JP V0, addr, Jump to location nnn + V0.
         The program counter is set to nnn plus the value of V0.
-        :rtype: object
+        :param nnn:
         """
-        addr = opcode & 0x0FFF
-        self.pc = self.registers[0] + addr - 2 # sub 2 as we add 2 at end of all ops
+        self.pc = ((self.registers[0] + nnn) & 0xFFF) - 2 # sub 2 as we add 2 at end of all ops
 
-    def rnd(self, opcode):
+    def rnd(self, vx, kk):
         """
         Cxkk - RND Vx, byte, Set Vx = random byte AND kk.
         The interpreter generates a random number from 0 to 255, which is then ANDed with the value kk.
         The results are stored in Vx. See instruction 8xy2 for more information on AND.
-        :param opcode:
+        :param vx:
+        :param kk:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = opcode & 0x00FF
-
-        rand = random.randint(0, 255)
+        rand = self.random.getrandbits(8)
 
-        self.registers[vx] = vy & rand
+        self.registers[vx] = kk & rand
 
-    def drw(self, opcode):
+    def drw(self, vx, vy, n):
         """
         Dxyn - DRW Vx, Vy, nibble, Display n-byte sprite starting at memory location I at (Vx, Vy), set VF = collision.
         The interpreter reads n bytes from memory, starting at the address stored in I. These bytes are then displayed
@@ -452,183 +639,208 @@ class Chip8(object):
         pixels to be erased, VF is set to 1, otherwise it is set to 0. If the sprite is positioned so part of it is
         outside the coordinates of the display, it wraps around to the opposite side of the screen. See instruction
         8xy3 for more information on XOR, and section 2.4, Display, for more information on the Chip-8 screen & sprites.
-        :rtype: object
+        :param vx:
+        :param vy:
+        :param n:
         """
-        vx = (opcode & 0x0F00) >> 8
-        vy = (opcode & 0x00F0) >> 4
-        n = opcode & 0x000F
-
         addr = self.index_register
-        sprite = self.memory[addr:addr + n]
+        sprite = self.memory_view[addr:addr + n]
 
         if self.draw(self.registers[vx], self.registers[vy], sprite):
             self.registers[0xf] = 1
         else:
             self.registers[0xf] = 0
 
+    def framebuffer(self):
+        """
+        Returns the display packed 8 pixels to a byte, row by row, the leftmost pixel in the most significant bit.
+        Each bit-plane follows the one before.
+        """
+        row_bytes = self.width // 8
+        return b''.join(row.to_bytes(row_bytes, 'big') for plane in self.planes for row in plane)
+
+    def load_framebuffer(self, data):
+        """
+        Fills the bit-planes back in from the start of data laid out as framebuffer returns it
+        :param data:
+        """
+        row_bytes = self.width // 8
+        offset = 0
+        for plane in self.planes:
+            plane[:] = [int.from_bytes(data[offset + i * row_bytes:offset + (i + 1) * row_bytes], 'big')
+                        for i in range(self.height)]
+            offset += self.height * row_bytes
+
+    def selected_planes(self):
+        """
+        The bit-planes drawing, scrolling and clearing act on
+        :return: list of planes
+        """
+        return self.planes
+
+    def colors(self):
+        """
+        The color of each pixel value, a pixel's value having a bit set for each plane it's lit in
+        :return: list of [r, g, b]
+        """
+        return [self.off_color, self.on_color]
+
     def set_grid_colors(self):
         """
-        sets the grid colors
+        repaints every pixel on the attached renderer, used when the colors change
         """
-        for i in range(len(self.shape_grid)):
-            for j in range(len(self.shape_grid[i])):
-                if self.grid[i][j] == 1:
-                    self.shape_grid[i][j].color = self.off_color
-                else:
-                    self.shape_grid[i][j].color = self.on_color
+        if self.renderer is not None:
+            self.renderer.set_grid_colors()
 
-    def draw(self, vx, vy, sprite):
+    def draw(self, vx, vy, sprite, sprite_width=8):
         """
-        Called from drw builds out the render grid and sets the colors
+        Called from drw, XORs each sprite row onto its packed grid row.
+        Pixels falling off the right or bottom edge are clipped.
+        :param vx:
+        :param vy:
+        :param sprite: rows of the sprite, bytes or sprite_width bit ints
+        :param sprite_width: pixels in a sprite row
         """
-        collision = False
-        for i, byte in enumerate(sprite):
-            for j, bit in enumerate(list(bin(byte)[2:].zfill(8))):
-                try:
-                    if self.grid[vy + i][vx + j] == 1 and int(bit) == 1:
-                        collision = True
-                    self.grid[vy + i][vx + j] = self.grid[vy + i][vx + j] ^ int(bit)
-                except IndexError:
-                    continue
-        self.set_grid_colors()
-        return collision
+        collision = 0
+        if vx < self.width:
+            grid = self.grid
+            # line the sprite row up with column vx, shifting right instead when it hangs off the edge
+            shift = self.width - sprite_width - vx
+            # zip stops at the bottom edge or the end of the sprite, whichever comes first
+            for y, line in zip(range(vy, self.height), sprite):
+                bits = line << shift if shift >= 0 else line >> -shift
+                row = grid[y]
+                collision |= row & bits
+                grid[y] = row ^ bits
+        return collision != 0
 
-    def skp(self, opcode):
+    def skp(self, vx):
         """
         Ex9E - SKP Vx, Skip next instruction if key with the value of Vx is pressed.
         Checks the keyboard, and if the key corresponding to the value of Vx is currently in the down position,
         PC is increased by 2.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        chip8_key = self.registers[vx]
+        chip8_key = self.registers[vx] & 0xF
         if self.keyboard_keys[chip8_key]:
             self.pc += 2
 
-    def sknp(self, opcode):
+    def sknp(self, vx):
         """
         ExA1 - SKNP Vx, Skip next instruction if key with the value of Vx is not pressed.
         Checks the keyboard, and if the key corresponding to the value of Vx is currently in the up position,
         PC is increased by 2.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        chip8_key = self.registers[vx]
+        chip8_key = self.registers[vx] & 0xF
         if not self.keyboard_keys[chip8_key]:
             self.pc += 2
 
-    def ld4(self, opcode):
+    def ld4(self, vx):
         """
         Fx07 - LD Vx, DT, Set Vx = delay timer value.
         The value of DT is placed into Vx.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
         self.registers[vx] = self.delay_timer
 
-    def ld5(self, opcode):
+    def ld5(self, vx):
         """
         Fx0A - LD Vx, K, Wait for a key press, store the value of the key in Vx.
         All execution stops until a key is pressed, then the value of that key is stored in Vx.
-        :param opcode:
+        The cpu halts on this instruction, the run loops stop issuing cycles until key_press stores the key in Vx.
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        active_key = None
-
-        while True:
-            if any(self.keyboard_keys):
-                active_keys = [index for index, val in enumerate(self.keyboard_keys) if val]
-                active_key = active_keys[0] if active_keys else None
-                break
-
-        self.registers[vx] = active_key
+        self.key_wait = vx
+        # stay on this instruction so raw cycle calls keep waiting too
+        self.pc -= 2
 
-    def ld6(self, opcode):
+    def ld6(self, vx):
         """
         Fx15 - LD DT, Vx, Set delay timer = Vx.
         DT is set equal to the value of Vx.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
         self.delay_timer = self.registers[vx]
 
-    def ld7(self, opcode):
+    def ld7(self, vx):
         """
         Fx18 - LD ST, Vx, Set sound timer = Vx.
         ST is set equal to the value of Vx.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
         self.sound_timer = self.registers[vx]
 
-    def add3(self, opcode):
+    def add3(self, vx):
         """
         Fx1E - ADD I, Vx, Set I = I + Vx.
         The values of I and Vx are added, and the results are stored in I.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        self.index_register += self.registers[vx]
+        self.index_register = (self.index_register + self.registers[vx]) & 0xFFF
 
-    def ld8(self, opcode):
+    def ld8(self, vx):
         """
         Fx29 - LD F, Vx, Set I = location of sprite for digit Vx.
         The value of I is set to the location for the hexadecimal sprite corresponding to the value of Vx.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        val = self.registers[vx]
+        val = self.registers[vx] & 0xF
         self.index_register = val * 5
 
-    def ld9(self, opcode):
+    def ld9(self, vx):
         """
         Fx33 - LD B, Vx, Store BCD representation of Vx in memory locations I, I+1, and I+2.
         The interpreter takes the decimal value of Vx, and places the hundreds digit in memory at location in I,
         the tens digit at location I+1, and the ones digit at location I+2.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        value = str(self.registers[vx])
-
-        fillNum = 3 - len(value)
-        value = '0' * fillNum + value
-
-        for i in range(len(value)):
-            self.memory[self.index_register + i] = int(value[i])
+        addr = self.index_register
+        self.memory_view[addr:addr + 3] = BCD_TABLE[self.registers[vx]]
 
-    def ld10(self, opcode):
+    def ld10(self, vx):
         """
         Fx55 - LD [I], Vx, Store registers V0 through Vx in memory starting at location I.
         The interpreter copies the values of registers V0 through Vx into memory, starting at the address in I.
-        :param opcode:
+        :param vx:
         """
-        vx = (opcode & 0x0F00) >> 8
-        for i in range(0, vx + 1):
-            self.memory[self.index_register + i] = self.registers[i]
+        addr = self.index_register
+        self.memory_view[addr:addr + vx + 1] = self.register_view[:vx + 1]
 
-    def ld11(self, opcode):
+    def ld11(self, vx):
         """
         Fx65 - LD Vx, [I], Read registers V0 through Vx from memory starting at location I.
         The interpreter reads values from memory starting at location I into registers V0 through Vx.
+        :param vx:
+        """
+        addr = self.index_register
+        self.register_view[:vx + 1] = self.memory_view[addr:addr + vx + 1]
+
+    def unknown(self, opcode):
+        """
+        Handler for opcodes with no matching instruction.
         :param opcode:
         """
-        vx = (opcode & 0x0F00) >> 8
-        for i in range(0, vx + 1):
-            self.registers[i] = self.memory[self.index_register + i]
+        raise ValueError(f'Unknown opcode 0x{opcode:x}')
 
     def load_rom(self, path_to_rom):
         """
-        Opens the rom file and loads it into memory
+        Reads the rom file in one go and loads it into memory
         :param path_to_rom:
         """
-        ptr = self.rom_pointer
         with open(path_to_rom, 'rb') as f:
-            while True:
-                byte = f.read(1)
-                if not byte:
-                    break
-                self.memory[ptr:ptr + 1] = [int.from_bytes(byte, "big", signed=False)]
-                ptr += 1
+            # one byte over what fits is enough for load_program to reject it
+            self.load_program(f.read(len(self.memory) - self.rom_pointer + 1))
+
+    def load_program(self, program):
+        """
+        Copies a program into memory at the rom pointer
+        :param program: rom bytes
+        """
+        space = len(self.memory) - self.rom_pointer
+        if len(program) > space:
+            raise ValueError(f'Rom is too big, only {space} bytes fit in memory after 0x{self.rom_pointer:03x}')
+        self.memory[self.rom_pointer:self.rom_pointer + len(program)] = program
 
     def cycle(self, force=False):
         """
@@ -636,27 +848,108 @@ class Chip8(object):
         Takes the current instructution and runs it
         """
         if not self.is_paused or force:
-            # Fetch opcode
-            opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
-
-            # lookup instruction to run and execute
-            self.opcode = self.get_instruction(opcode)
-            if len(self.sample_instructions) > self.sample_instructions_size:
-                self.sample_instructions.popleft()
+            # Fetch opcode and look up its pre-decoded handler and operands
+            run, operands, self.opcode = self.decode_table[self.memory[self.pc] << 8 | self.memory[self.pc + 1]]
             self.sample_instructions.append(self.opcode)
-            self.opcode.run(opcode)
+            run(self, *operands)
             self.pc += 2
 
-            if self.delay_timer > 0:
-                self.delay_timer -= 1
-            if self.sound_timer > 0:
-                self.sound_timer -= 1
-                if self.sound_timer == 0:
-                    self.audio.play()
+    def run_cycles(self, count):
+        """
+        Runs a number of cpu cycles back to back without touching the timers
+        :param count:
+        """
+        cycle = self.cycle
+        for _ in range(count):
+            cycle()
+        self.cycle_count += count
+
+    def execute(self, count):
+        """
+        Runs up to count instructions ignoring pause, stopping early if the cpu halts on Fx0A.
+        Unlike run_cycles it leaves the cycle counters to the caller.
+        :param count:
+        :return: number of instructions run
+        """
+        cycle = self.cycle
+        for i in range(count):
+            cycle(True)
+            if self.key_wait is not None:
+                return i + 1
+        return count
+
+    def tick_timers(self):
+        """
+        Counts the delay and sound timers down by one, called at 60 Hz. The buzzer sounds for the frames the sound timer
+        is above zero, so the audio frontend renders the frame before it counts down
+        """
+        if self.audio is not None:
+            self.audio.tick(self)
+        if self.delay_timer > 0:
+            self.delay_timer -= 1
+        if self.sound_timer > 0:
+            self.sound_timer -= 1
+
+    def run_frame(self):
+        """
+        Runs one 60 Hz frame of emulated time, cycles_per_frame instructions followed by a timer tick.
+        While halted on Fx0A the frame's cycles are counted without running anything.
+        """
+        if not self.is_paused:
+            count = max(self.cycles_per_frame - self.frame_cycles, 0)
+            if self.key_wait is None:
+                self.run_cycles(count)
+            else:
+                self.cycle_count += count
+            self.frame_cycles = 0
+            self.tick_timers()
+
+    def run_until(self, cycles=None, pc=None, frames=None):
+        """
+        Runs flat out, ignoring pause, until the first of the given conditions is met.
+        Timers tick at frame boundaries exactly as they do under run_frame. While the cpu is halted on Fx0A cycles are
+        counted without running anything, or with only a pc condition, which can then never be met, it returns.
+        :param cycles: stop after this many instructions
+        :param pc: stop when the program counter reaches this address (checked after the first instruction)
+        :param frames: stop after this many 60 Hz frames
+        :return: number of instructions run
+        """
+        if cycles is None and pc is None and frames is None:
+            raise ValueError('run_until needs at least one of cycles, pc or frames')
+        cycle = self.cycle
+        ran = 0
+        frames_run = 0
+        while (cycles is None or ran < cycles) and (frames is None or frames_run < frames):
+            # run up to the next frame boundary or the end of the cycle budget, whichever comes first
+            count = max(self.cycles_per_frame - self.frame_cycles, 0)
+            if cycles is not None:
+                count = min(count, cycles - ran)
+            if self.key_wait is not None:
+                if cycles is None and frames is None:
+                    break
+            elif pc is None:
+                count = self.execute(count)
+            else:
+                for i in range(count):
+                    cycle(True)
+                    if self.pc == pc or self.key_wait is not None:
+                        count = i + 1
+                        break
+            ran += count
+            self.cycle_count += count
+            self.frame_cycles += count
+            if self.frame_cycles >= self.cycles_per_frame:
+                self.frame_cycles = 0
+                self.tick_timers()
+                frames_run += 1
+            if pc is not None and self.pc == pc:
+                break
+        return ran
 
     def render(self):
         """
-        Call the pyglet batch render for rendering all the shapes
+        Draws the grid through the attached renderer
         """
-        self.batch.draw()
+        if self.renderer is not None:
+            self.renderer.render()
 
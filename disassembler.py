@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Static disassembler for chip8 roms.
+
+A rom is decoded in one pass from its entry point, following JP, CALL and the skip instructions to find every
+reachable instruction. Those are split into basic blocks linked into a control flow graph, bytes never reached are
+kept as data. Results are cached per rom SHA-1.
+
+    python disassembler.py rom [--blocks] [--mode chip8|schip|xochip]
+"""
+import argparse
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+from chip8 import Chip8, OpCode, UNKNOWN, build_decode_table
+from extended import MODES
+
+# address roms are loaded at and start running from
+ORIGIN = 0x200
+
+# handlers which end a basic block, grouped by where control goes next
+JUMPS = {'jp'}
+CALLS = {'call'}
+RETURNS = {'ret'}
+SKIPS = {'se', 'sne', 'se2', 'sne2', 'skp', 'sknp'}
+INDIRECT_JUMPS = {'jp2'}
+# handlers taking the 16 bit word following their opcode as the operand, making the instruction four bytes long
+LONG_INSTRUCTIONS = {'ld17'}
+
+_disassemblies = {}
+
+
+@dataclass
+class Instruction:
+    """Class for keeping track of a decoded instruction."""
+    address: int = 0
+    opcode: int = 0
+    op: OpCode = None
+    text: str = ''
+    # bytes the instruction takes up
+    size: int = 2
+
+
+@dataclass
+class BasicBlock:
+    """Class for keeping track of a straight line run of instructions."""
+    start: int = 0
+    # address after the last instruction
+    end: int = 0
+    instructions: List[Instruction] = field(default_factory=list)
+    # blocks control can flow to next, in the order branches take them
+    successors: List[int] = field(default_factory=list)
+    # subroutines called from the end of the block, returning to its fall through successor
+    calls: List[int] = field(default_factory=list)
+    # the block ends in JP V0, addr whose target isn't known until it runs
+    indirect: bool = False
+
+
+@dataclass
+class Disassembly:
+    """Class for keeping track of a disassembled rom."""
+    rom_sha1: str = ''
+    origin: int = ORIGIN
+    rom: bytes = b''
+    # address -> reachable instruction
+    instructions: Dict[int, Instruction] = field(default_factory=dict)
+    # start address -> basic block
+    blocks: Dict[int, BasicBlock] = field(default_factory=dict)
+    # addresses of subroutines, the targets of CALL
+    subroutines: List[int] = field(default_factory=list)
+
+    def block_at(self, address):
+        """
+        Finds the basic block holding the instruction at address
+        :param address:
+        :return: BasicBlock or None when the address isn't reachable code
+        """
+        for block in self.blocks.values():
+            if block.start <= address < block.end:
+                return block
+        return None
+
+    def listing(self):
+        """
+        Lays the whole rom out as (address, text) lines, reachable code as instructions and the rest as data bytes
+        :return: list of (address, text)
+        """
+        lines = []
+        address = self.origin
+        end = self.origin + len(self.rom)
+        while address < end:
+            instruction = self.instructions.get(address)
+            if instruction is not None:
+                label = 'sub' if address in self.subroutines else 'loc' if address in self.blocks else '   '
+                lines.append((address, f'{label} 0x{address:03x}  {instruction.opcode:04x}  {instruction.text}'))
+                address += instruction.size
+            else:
+                value = self.rom[address - self.origin]
+                lines.append((address, f'    0x{address:03x}  {value:02x}    db 0x{value:02x}'))
+                address += 1
+        return lines
+
+
+def format_instruction(op, opcode):
+    """
+    Fills an instruction's asm template in with the operands of opcode, e.g. 'LD Vx, byte' to 'LD V3, 0x1f'
+    :param op: OpCode the opcode decoded to
+    :param opcode:
+    :return: str
+    """
+    if op is UNKNOWN:
+        return f'??? 0x{opcode:04x}'
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    return op.asm.replace(' {, Vy}', f', V{y:X}') \
+        .replace('Vx', f'V{x:X}') \
+        .replace('Vy', f'V{y:X}') \
+        .replace('addr', f'0x{opcode & 0x0FFF:03x}') \
+        .replace('byte', f'0x{opcode & 0x00FF:02x}') \
+        .replace('nibble', str(opcode & 0x000F)) \
+        .replace('mask', str(x))
+
+
+def disassemble(rom, origin=ORIGIN, cls=Chip8):
+    """
+    Decodes every instruction reachable from origin and builds the basic blocks and control flow graph, cached per
+    rom hash
+    :param rom: rom bytes
+    :param origin: address the rom is loaded at and entered from
+    :param cls: Chip8 or a subclass whose instruction set the rom uses
+    :return: Disassembly
+    """
+    rom = bytes(rom)
+    rom_sha1 = hashlib.sha1(rom).hexdigest()
+    key = (rom_sha1, origin, cls)
+    disassembly = _disassemblies.get(key)
+    if disassembly is None:
+        disassembly = _disassemblies[key] = build_disassembly(rom, rom_sha1, origin, cls)
+    return disassembly
+
+
+def disassemble_rom(path_to_rom, cls=Chip8):
+    """
+    Disassembles a rom file
+    :param path_to_rom:
+    :param cls: Chip8 or a subclass whose instruction set the rom uses
+    :return: Disassembly
+    """
+    return disassemble(Path(path_to_rom).read_bytes(), cls=cls)
+
+
+def build_disassembly(rom, rom_sha1, origin, cls):
+    """
+    Does the work for disassemble, uncached
+    """
+    table = build_decode_table(cls)
+    end = origin + len(rom)
+    instructions = {}
+    # addresses starting a block, the entry point and every branch target
+    leaders = {origin}
+    # address -> (successors, calls, indirect) of the instructions ending a block
+    exits = {}
+    subroutines = set()
+    pending = [origin]
+    while pending:
+        address = pending.pop()
+        # walk the straight line from address until an instruction leaves it or one already decoded is reached
+        while origin <= address < end - 1 and address not in instructions:
+            opcode = rom[address - origin] << 8 | rom[address - origin + 1]
+            op = table[opcode][2]
+            instruction = instructions[address] = Instruction(address, opcode, op, format_instruction(op, opcode))
+            if op.handler in LONG_INSTRUCTIONS and address + 3 < end:
+                word = rom[address - origin + 2] << 8 | rom[address - origin + 3]
+                instruction.text = op.asm.replace('long', f'0x{word:04x}')
+                instruction.size = 4
+            following = address + instruction.size
+            if op.handler in JUMPS:
+                targets, calls = [opcode & 0x0FFF], []
+            elif op.handler in CALLS:
+                targets, calls = [following], [opcode & 0x0FFF]
+                subroutines.add(opcode & 0x0FFF)
+            elif op.handler in SKIPS:
+                # skips step over the whole of a long instruction
+                skipped = 2
+                if following < end - 1:
+                    skipped_op = table[rom[following - origin] << 8 | rom[following - origin + 1]][2]
+                    if skipped_op.handler in LONG_INSTRUCTIONS:
+                        skipped = 4
+                targets, calls = [following, following + skipped], []
+            elif op.handler in RETURNS or op.handler in INDIRECT_JUMPS or op is UNKNOWN:
+                targets, calls = [], []
+            else:
+                address = following
+                continue
+            exits[address] = ([target for target in targets if origin <= target < end - 1], calls,
+                              op.handler in INDIRECT_JUMPS)
+            leaders.update(targets + calls)
+            pending.extend(targets + calls)
+            break
+        else:
+            # ran into code already decoded, which now starts a block of its own
+            if address in instructions:
+                leaders.add(address)
+
+    # cut the reachable instructions into blocks at every leader and exit
+    blocks = {}
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        block = BasicBlock(start=start)
+        address = start
+        while address in instructions:
+            instruction = instructions[address]
+            block.instructions.append(instruction)
+            if address in exits:
+                block.successors, block.calls, block.indirect = exits[address]
+                address += instruction.size
+                break
+            address += instruction.size
+            if address in leaders:
+                block.successors = [address] if address in instructions else []
+                break
+        block.end = address
+        blocks[start] = block
+    return Disassembly(rom_sha1=rom_sha1, origin=origin, rom=rom, instructions=instructions, blocks=blocks,
+                       subroutines=sorted(subroutines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Disassemble a chip8 rom')
+    parser.add_argument('rom', type=Path, help='rom to disassemble')
+    parser.add_argument('--blocks', action='store_true', help='list the basic blocks and their successors instead')
+    parser.add_argument('--mode', choices=sorted(MODES), default='chip8', help='instruction set the rom uses')
+    args = parser.parse_args()
+
+    disassembly = disassemble_rom(args.rom, MODES[args.mode])
+    if not args.blocks:
+        print('\n'.join(text for _, text in disassembly.listing()))
+        return
+    for block in disassembly.blocks.values():
+        successors = ' '.join(f'0x{address:03x}' for address in block.successors)
+        calls = ' '.join(f'call 0x{address:03x}' for address in block.calls)
+        print(f'0x{block.start:03x}-0x{block.end:03x} {len(block.instructions):>3} -> {successors} {calls}'
+              f'{" indirect" if block.indirect else ""}')
+
+
+if __name__ == "__main__":
+    main()
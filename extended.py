@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+SUPER-CHIP and XO-CHIP extended modes.
+
+SuperChip8 adds the SUPER-CHIP 1.1 instructions to the core: a 128x64 high resolution display switched to with 00FF,
+scrolling, 16x16 sprites drawn with Dxy0, a large font and the RPL user flags. XoChip8 builds on it with 64 KB of
+memory, a second bit-plane giving four colors, the 16 bit I load F000 NNNN and an audio pattern buffer.
+
+Display rows stay packed one int per row whatever the resolution, so drawing costs the same per sprite row in either
+mode and a renderer only needs to re-upload the rows that changed.
+"""
+import struct
+
+from chip8 import Chip8, INSTRUCTIONS, OpCode
+
+SUPER_CHIP_INSTRUCTIONS = [
+    OpCode(bytecode=0x00C0, asm="SCD nibble", desc="Scroll the display down n rows.", handler='scd', mask=0xFFF0, operands='n'),
+    OpCode(bytecode=0x00FB, asm="SCR", desc="Scroll the display right 4 pixels.", handler='scr', mask=0xFFFF),
+    OpCode(bytecode=0x00FC, asm="SCL", desc="Scroll the display left 4 pixels.", handler='scl', mask=0xFFFF),
+    OpCode(bytecode=0x00FD, asm="EXIT", desc="Exit the interpreter.", handler='exit', mask=0xFFFF),
+    OpCode(bytecode=0x00FE, asm="LOW", desc="Switch to the 64x32 display.", handler='low', mask=0xFFFF),
+    OpCode(bytecode=0x00FF, asm="HIGH", desc="Switch to the 128x64 display.", handler='high', mask=0xFFFF),
+    OpCode(bytecode=0xD000, asm="DRW Vx, Vy, 0", desc="Display 16x16 sprite", handler='drw2', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0xF030, asm="LD HF, Vx", desc="Set I = location of large sprite for digit Vx.", handler='ld12', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF075, asm="LD R, Vx", desc="Store registers V0 through Vx in the RPL user flags.", handler='ld13', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF085, asm="LD Vx, R", desc="Read registers V0 through Vx from the RPL user flags.", handler='ld14', mask=0xF0FF, operands='x'),
+]
+
+XO_CHIP_INSTRUCTIONS = [
+    OpCode(bytecode=0x00D0, asm="SCU nibble", desc="Scroll the display up n rows.", handler='scu', mask=0xFFF0, operands='n'),
+    OpCode(bytecode=0x5002, asm="LD [I], Vx - Vy", desc="Store registers Vx through Vy in memory starting at location I.", handler='ld15', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0x5003, asm="LD Vx - Vy, [I]", desc="Read registers Vx through Vy from memory starting at location I.", handler='ld16', mask=0xF00F, operands='xy'),
+    OpCode(bytecode=0xF000, asm="LD I, long", desc="Set I = the 16 bit address following the instruction.", handler='ld17', mask=0xFFFF),
+    OpCode(bytecode=0xF001, asm="PLANE mask", desc="Select the bit-planes drawn to.", handler='plane', mask=0xF0FF, operands='x'),
+    OpCode(bytecode=0xF002, asm="LD AUDIO, [I]", desc="Load the 16 byte audio pattern from memory at I.", handler='ld18', mask=0xFFFF),
+    OpCode(bytecode=0xF03A, asm="LD PITCH, Vx", desc="Set the audio pattern playback pitch = Vx.", handler='ld19', mask=0xF0FF, operands='x'),
+]
+
+# the 8x10 pixel digits (0-F) Fx30 points I at, stored after the small font
+BIG_FONT_ADDRESS = 80
+BIG_FONT = [
+    0xFF, 0xFF, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF,  # 0
+    0x18, 0x78, 0x78, 0x18, 0x18, 0x18, 0x18, 0x18, 0xFF, 0xFF,  # 1
+    0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # 2
+    0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 3
+    0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0x03, 0x03,  # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 5
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 6
+    0xFF, 0xFF, 0x03, 0x03, 0x06, 0x0C, 0x18, 0x18, 0x18, 0x18,  # 7
+    0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 8
+    0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 9
+    0x7E, 0xFF, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3,  # A
+    0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC,  # B
+    0x3C, 0xFF, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0xFF, 0x3C,  # C
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC,  # D
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # E
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0,  # F
+]
+
+# save state trailers appended after the Chip8 state. SUPER-CHIP: magic, high resolution, RPL user flags.
+# XO-CHIP, after that: magic, selected planes, pitch, audio pattern
+SUPER_STATE_MAGIC = b'SCST'
+SUPER_STATE = struct.Struct('<4sB16s')
+XO_STATE_MAGIC = b'XOST'
+XO_STATE = struct.Struct('<4sBB16s')
+
+# the buzzer until a program loads its own pattern, 8 samples on and 8 off, a 250 Hz square wave at the default pitch
+DEFAULT_AUDIO_PATTERN = bytes([0xFF, 0x00] * 8)
+
+
+class SuperChip8(Chip8):
+    """
+    Chip8 with the SUPER-CHIP 1.1 instructions. It starts in the 64x32 display, 00FF switches to 128x64.
+    """
+    instructions = INSTRUCTIONS + SUPER_CHIP_INSTRUCTIONS
+
+    def __init__(self, scale=10, seed=None) -> None:
+        super().__init__(scale, seed)
+        self.memory[BIG_FONT_ADDRESS:BIG_FONT_ADDRESS + len(BIG_FONT)] = BIG_FONT
+        # drawing to the 128x64 display rather than the 64x32 one
+        self.hires = False
+        # HP48 RPL user flags, kept across resets as the calculator kept them
+        self.rpl_flags = bytearray(16)
+
+    def reset(self):
+        """
+        Returns variables to initial state for game reload, back in the 64x32 display
+        """
+        super().reset()
+        self.set_resolution(False)
+
+    def save_state(self):
+        """
+        Captures the machine state as a compact binary blob, the Chip8 state followed by the display mode and flags
+        :return: bytes
+        """
+        return super().save_state() + SUPER_STATE.pack(SUPER_STATE_MAGIC, self.hires, bytes(self.rpl_flags))
+
+    def load_state(self, state):
+        """
+        Restores the machine state from a blob made by save_state
+        :param state:
+        """
+        magic, hires, rpl_flags = SUPER_STATE.unpack_from(state, len(state) - SUPER_STATE.size)
+        if magic != SUPER_STATE_MAGIC:
+            raise ValueError('Not a SUPER-CHIP save state')
+        # the framebuffer is laid out at the resolution it was saved in
+        self.set_resolution(bool(hires))
+        super().load_state(state)
+        self.rpl_flags[:] = rpl_flags
+
+    def set_resolution(self, hires):
+        """
+        Switches between the 64x32 and 128x64 displays, clearing every plane
+        :param hires:
+        """
+        self.hires = hires
+        self.width, self.height = (128, 64) if hires else (64, 32)
+        for plane in self.planes:
+            plane[:] = [0] * self.height
+
+    def scd(self, n):
+        """
+        00Cn - SCD nibble, Scroll the display down n rows.
+        Rows scrolled in at the top are blank.
+        :param n:
+        """
+        if n:
+            for grid in self.selected_planes():
+                grid[:] = [0] * n + grid[:-n]
+
+    def scr(self):
+        """
+        00FB - SCR, Scroll the display right 4 pixels.
+        """
+        for grid in self.selected_planes():
+            grid[:] = [row >> 4 for row in grid]
+
+    def scl(self):
+        """
+        00FC - SCL, Scroll the display left 4 pixels.
+        """
+        mask = (1 << self.width) - 1
+        for grid in self.selected_planes():
+            grid[:] = [(row << 4) & mask for row in grid]
+
+    def exit(self):
+        """
+        00FD - EXIT, Exit the interpreter.
+        The machine pauses, staying on this instruction.
+        """
+        self.is_paused = True
+        self.pc -= 2
+
+    def low(self):
+        """
+        00FE - LOW, Switch to the 64x32 display.
+        """
+        self.set_resolution(False)
+
+    def high(self):
+        """
+        00FF - HIGH, Switch to the 128x64 display.
+        """
+        self.set_resolution(True)
+
+    def drw2(self, vx, vy):
+        """
+        Dxy0 - DRW Vx, Vy, 0, Display a 16x16 sprite starting at memory location I at (Vx, Vy), set VF = collision.
+        Each row of the sprite is two bytes, the left half first.
+        :param vx:
+        :param vy:
+        """
+        addr = self.index_register
+        memory = self.memory
+        end = addr + 32 * len(self.selected_planes())
+        sprite = [memory[i] << 8 | memory[i + 1] for i in range(addr, end, 2)]
+
+        if self.draw(self.registers[vx], self.registers[vy], sprite, 16):
+            self.registers[0xf] = 1
+        else:
+            self.registers[0xf] = 0
+
+    def ld12(self, vx):
+        """
+        Fx30 - LD HF, Vx, Set I = location of large sprite for digit Vx.
+        The value of I is set to the location of the 8x10 sprite for the hexadecimal digit in Vx.
+        :param vx:
+        """
+        self.index_register = BIG_FONT_ADDRESS + (self.registers[vx] & 0xF) * 10
+
+    def ld13(self, vx):
+        """
+        Fx75 - LD R, Vx, Store registers V0 through Vx in the RPL user flags.
+        :param vx:
+        """
+        self.rpl_flags[:vx + 1] = self.register_view[:vx + 1]
+
+    def ld14(self, vx):
+        """
+        Fx85 - LD Vx, R, Read registers V0 through Vx from the RPL user flags.
+        :param vx:
+        """
+        self.register_view[:vx + 1] = self.rpl_flags[:vx + 1]
+
+
+class XoChip8(SuperChip8):
+    """
+    SuperChip8 with the XO-CHIP instructions, 64 KB of memory and two bit-planes. Skips step over the whole of a
+    F000 NNNN.
+    """
+    instructions = SuperChip8.instructions + XO_CHIP_INSTRUCTIONS
+    memory_size = 0x10000
+
+    def __init__(self, scale=10, seed=None) -> None:
+        super().__init__(scale, seed)
+        self.planes.append([0] * self.height)
+        # bit n set selects plane n for drawing, scrolling and clearing
+        self.plane_mask = 1
+        self.plane_color = [255, 102, 0]
+        # pixels lit in both planes
+        self.blend_color = [102, 34, 0]
+        # 128 one bit samples played while the sound timer runs, at 4000 * 2 ** ((pitch - 64) / 48) samples a second
+        self.audio_pattern = bytearray(DEFAULT_AUDIO_PATTERN)
+        self.pitch = 64
+
+    def reset(self):
+        """
+        Returns variables to initial state for game reload
+        """
+        super().reset()
+        self.plane_mask = 1
+        self.audio_pattern[:] = DEFAULT_AUDIO_PATTERN
+        self.pitch = 64
+
+    def save_state(self):
+        """
+        Captures the machine state as a compact binary blob, the SUPER-CHIP state followed by the planes and audio
+        :return: bytes
+        """
+        return super().save_state() + XO_STATE.pack(XO_STATE_MAGIC, self.plane_mask, self.pitch, bytes(self.audio_pattern))
+
+    def load_state(self, state):
+        """
+        Restores the machine state from a blob made by save_state
+        :param state:
+        """
+        magic, self.plane_mask, self.pitch, audio_pattern = XO_STATE.unpack_from(state, len(state) - XO_STATE.size)
+        if magic != XO_STATE_MAGIC:
+            raise ValueError('Not an XO-CHIP save state')
+        super().load_state(state[:-XO_STATE.size])
+        self.audio_pattern[:] = audio_pattern
+
+    def colors(self):
+        """
+        The color of each pixel value: off, lit in the first plane, in the second, in both
+        :return: list of [r, g, b]
+        """
+        return [self.off_color, self.on_color, self.plane_color, self.blend_color]
+
+    def selected_planes(self):
+        """
+        The bit-planes drawing, scrolling and clearing act on
+        :return: list of planes
+        """
+        return [plane for bit, plane in enumerate(self.planes) if self.plane_mask >> bit & 1]
+
+    def skip(self):
+        """
+        Skips the next instruction, all four bytes of it when it's a F000 NNNN
+        """
+        memory = self.memory
+        self.pc += 4 if memory[self.pc + 2] == 0xF0 and memory[self.pc + 3] == 0x00 else 2
+
+    def cls(self):
+        """
+        00E0 - CLS, Clear the selected planes.
+        """
+        for grid in self.selected_planes():
+            grid[:] = [0] * self.height
+
+    def se(self, vx, kk):
+        """
+        3xkk - SE Vx, byte, Skip next instruction if Vx = kk.
+        :param vx:
+        :param kk:
+        """
+        if self.registers[vx] == kk:
+            self.skip()
+
+    def sne(self, vx, kk):
+        """
+        4xkk - SNE Vx, byte, Skip next instruction if Vx != kk.
+        :param vx:
+        :param kk:
+        """
+        if self.registers[vx] != kk:
+            self.skip()
+
+    def se2(self, vx, vy):
+        """
+        5xy0 - SE Vx, Vy, Skip next instruction if Vx = Vy.
+        :param vx:
+        :param vy:
+        """
+        if self.registers[vx] == self.registers[vy]:
+            self.skip()
+
+    def sne2(self, vx, vy):
+        """
+        9xy0 - SNE Vx, Vy, Skip next instruction if Vx != Vy.
+        :param vx:
+        :param vy:
+        """
+        if self.registers[vx] != self.registers[vy]:
+            self.skip()
+
+    def skp(self, vx):
+        """
+        Ex9E - SKP Vx, Skip next instruction if key with the value of Vx is pressed.
+        :param vx:
+        """
+        if self.keyboard_keys[self.registers[vx] & 0xF]:
+            self.skip()
+
+    def sknp(self, vx):
+        """
+        ExA1 - SKNP Vx, Skip next instruction if key with the value of Vx is not pressed.
+        :param vx:
+        """
+        if not self.keyboard_keys[self.registers[vx] & 0xF]:
+            self.skip()
+
+    def drw(self, vx, vy, n):
+        """
+        Dxyn - DRW Vx, Vy, nibble, Display n-byte sprite starting at memory location I at (Vx, Vy), set VF = collision.
+        With both planes selected the sprite for the second plane follows the first's.
+        :param vx:
+        :param vy:
+        :param n:
+        """
+        addr = self.index_register
+        sprite = self.memory_view[addr:addr + n * len(self.selected_planes())]
+
+        if self.draw(self.registers[vx], self.registers[vy], sprite):
+            self.registers[0xf] = 1
+        else:
+            self.registers[0xf] = 0
+
+    def draw(self, vx, vy, sprite, sprite_width=8):
+        """
+        Called from drw, XORs each selected plane's share of the sprite rows onto the plane.
+        Pixels falling off the right or bottom edge are clipped.
+        :param vx:
+        :param vy:
+        :param sprite: rows of the sprite for each selected plane in turn
+        :param sprite_width: pixels in a sprite row
+        """
+        collision = 0
+        planes = self.selected_planes()
+        if vx < self.width and planes:
+            shift = self.width - sprite_width - vx
+            rows = len(sprite) // len(planes)
+            for i, grid in enumerate(planes):
+                for y, line in zip(range(vy, self.height), sprite[i * rows:(i + 1) * rows]):
+                    bits = line << shift if shift >= 0 else line >> -shift
+                    row = grid[y]
+                    collision |= row & bits
+                    grid[y] = row ^ bits
+        return collision != 0
+
+    def scu(self, n):
+        """
+        00Dn - SCU nibble, Scroll the display up n rows.
+        Rows scrolled in at the bottom are blank.
+        :param n:
+        """
+        for grid in self.selected_planes():
+            grid[:] = grid[n:] + [0] * n
+
+    def add3(self, vx):
+        """
+        Fx1E - ADD I, Vx, Set I = I + Vx, I being 16 bits wide.
+        :param vx:
+        """
+        self.index_register = (self.index_register + self.registers[vx]) & 0xFFFF
+
+    def ld15(self, vx, vy):
+        """
+        5xy2 - LD [I], Vx - Vy, Store registers Vx through Vy in memory starting at location I.
+        With x greater than y the registers are stored in descending order. I is left unchanged.
+        :param vx:
+        :param vy:
+        """
+        addr = self.index_register
+        if vx <= vy:
+            self.memory_view[addr:addr + vy - vx + 1] = self.register_view[vx:vy + 1]
+        else:
+            self.memory_view[addr:addr + vx - vy + 1] = self.registers[vy:vx + 1][::-1]
+
+    def ld16(self, vx, vy):
+        """
+        5xy3 - LD Vx - Vy, [I], Read registers Vx through Vy from memory starting at location I.
+        With x greater than y the registers are read in descending order. I is left unchanged.
+        :param vx:
+        :param vy:
+        """
+        addr = self.index_register
+        if vx <= vy:
+            self.register_view[vx:vy + 1] = self.memory_view[addr:addr + vy - vx + 1]
+        else:
+            self.register_view[vy:vx + 1] = self.memory[addr:addr + vx - vy + 1][::-1]
+
+    def ld17(self):
+        """
+        F000 NNNN - LD I, long, Set I = the 16 bit address in the two bytes following the instruction.
+        The instruction is four bytes long.
+        """
+        memory = self.memory
+        self.index_register = memory[self.pc + 2] << 8 | memory[self.pc + 3]
+        self.pc += 2
+
+    def plane(self, mask):
+        """
+        Fn01 - PLANE mask, Select the bit-planes drawn to, bit 0 the first and bit 1 the second.
+        :param mask:
+        """
+        self.plane_mask = mask & 0x3
+
+    def ld18(self):
+        """
+        F002 - LD AUDIO, [I], Load the 16 byte audio pattern from memory at I.
+        """
+        addr = self.index_register
+        memoryview(self.audio_pattern)[:] = self.memory_view[addr:addr + 16]
+
+    def ld19(self, vx):
+        """
+        Fx3A - LD PITCH, Vx, Set the audio pattern playback pitch = Vx.
+        :param vx:
+        """
+        self.pitch = self.registers[vx]
+
+
+# machine classes by the name of their instruction set
+MODES = {
+    'chip8': Chip8,
+    'schip': SuperChip8,
+    'xochip': XoChip8,
+}
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation hooks for the Chip8 core.
+
+Callbacks are registered with Chip8.add_hook for one of HOOK_EVENTS:
+
+    pre_instruction(c8, pc, op)           before the instruction at pc runs, op being its OpCode
+    post_instruction(c8, pc, op)          after it has run
+    memory_write(c8, addr, length)        after Fx33/Fx55, or XO-CHIP's 5xy2, wrote memory[addr:addr + length]
+    draw(c8, x, y, sprite, collision)     after a sprite was XORed onto the grid, sprite being its rows, for Dxyn a
+                                          memoryview onto memory, copy it with bytes() to keep it
+    timer(c8)                             after each 60 Hz timer tick
+
+The wrappers built here are only swapped in while a hook needing them is registered, the plain path pays nothing.
+"""
+
+HOOK_EVENTS = ('pre_instruction', 'post_instruction', 'memory_write', 'draw', 'timer')
+# events needing every instruction to go through the hooked cycle
+INSTRUCTION_EVENTS = ('pre_instruction', 'post_instruction', 'memory_write')
+# handlers writing memory -> number of bytes written from I given the handler's operands
+MEMORY_WRITES = {
+    'ld9': lambda vx: 3,
+    'ld10': lambda vx: vx + 1,
+    'ld15': lambda vx, vy: abs(vx - vy) + 1,
+}
+
+
+def hooked_cycle(c8, cycle):
+    """
+    Builds a drop in replacement for c8.cycle calling the instruction and memory write hooks around cycle
+    :param c8:
+    :param cycle: the cycle function to wrap
+    :return: hooked cycle function
+    """
+    pre_instruction = c8.hooks['pre_instruction']
+    post_instruction = c8.hooks['post_instruction']
+    memory_write = c8.hooks['memory_write']
+
+    def cycle_with_hooks(force=False):
+        if c8.is_paused and not force:
+            return
+        pc = c8.pc
+        _, operands, op = c8.decode_table[c8.memory[pc] << 8 | c8.memory[pc + 1]]
+        for hook in pre_instruction:
+            hook(c8, pc, op)
+        addr = c8.index_register
+        cycle(force)
+        if memory_write and op.handler in MEMORY_WRITES:
+            length = MEMORY_WRITES[op.handler](*operands)
+            for hook in memory_write:
+                hook(c8, addr, length)
+        for hook in post_instruction:
+            hook(c8, pc, op)
+
+    return cycle_with_hooks
+
+
+def hooked_draw(c8, draw):
+    """
+    Builds a drop in replacement for c8.draw calling the draw hooks after each sprite
+    :param c8:
+    :param draw: the draw function to wrap
+    :return: hooked draw function
+    """
+    hooks = c8.hooks['draw']
+
+    def draw_with_hooks(x, y, sprite, *args):
+        collision = draw(x, y, sprite, *args)
+        for hook in hooks:
+            hook(c8, x, y, sprite, collision)
+        return collision
+
+    return draw_with_hooks
+
+
+def hooked_tick_timers(c8, tick_timers):
+    """
+    Builds a drop in replacement for c8.tick_timers calling the timer hooks after each tick
+    :param c8:
+    :param tick_timers: the tick_timers function to wrap
+    :return: hooked tick_timers function
+    """
+    hooks = c8.hooks['timer']
+
+    def tick_timers_with_hooks():
+        tick_timers()
+        for hook in hooks:
+            hook(c8)
+
+    return tick_timers_with_hooks
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Block translating execution engine.
+
+Straight-line runs of chip8 instructions are translated into a generated python function (one per start address)
+which is cached and replayed, instead of dispatching every instruction through cycle. A block longer than the cycles
+left before the next timer tick is translated again cut short at that budget, and kept alongside the full one. Blocks
+are thrown away when Fx33/Fx55 or a rom load write over the memory they were built from. Blocks translated from a
+rom's own bytes are shared through the rom library with every other machine running the same rom. While profiling or
+with instruction hooks it steps the interpreter instead.
+"""
+from chip8 import Chip8, INSTRUCTIONS, UNKNOWN
+from romlibrary import LIBRARY
+
+# longest run of instructions translated into a single block
+MAX_BLOCK_LENGTH = 64
+
+# python statements mirroring the handlers that are simple enough to inline, r being the registers and f a scratch
+# flag written to VF last as the handlers do
+INLINE = {
+    'ld': ['r[{x}] = {kk}'],
+    'add': ['r[{x}] = (r[{x}] + {kk}) & 0xFF'],
+    'ld2': ['r[{x}] = r[{y}]'],
+    'OR': ['r[{x}] = r[{x}] | r[{y}]'],
+    'AND': ['r[{x}] = r[{x}] & r[{y}]'],
+    'XOR': ['r[{x}] = r[{x}] ^ r[{y}]'],
+    'add2': ['f = r[{x}] + r[{y}]', 'r[{x}] = f & 0xFF', 'r[15] = f >> 8'],
+    'sub': ['f = 1 if r[{x}] >= r[{y}] else 0', 'r[{x}] = (r[{x}] - r[{y}]) & 0xFF', 'r[15] = f'],
+    'shr': ['f = r[{x}] & 0x1', 'r[{x}] >>= 1', 'r[15] = f'],
+    'subn': ['f = 1 if r[{y}] >= r[{x}] else 0', 'r[{x}] = (r[{y}] - r[{x}]) & 0xFF', 'r[15] = f'],
+    'shl': ['f = r[{x}] >> 7', 'r[{x}] = (r[{x}] << 1) & 0xFF', 'r[15] = f'],
+    'ld3': ['self.index_register = {nnn}'],
+    'ld4': ['r[{x}] = self.delay_timer'],
+    'ld6': ['self.delay_timer = r[{x}]'],
+    'ld7': ['self.sound_timer = r[{x}]'],
+    'add3': ['self.index_register = (self.index_register + r[{x}]) & 0xFFF'],
+    'ld8': ['self.index_register = (r[{x}] & 0xF) * 5'],
+}
+
+# branches which end a block by setting the program counter themselves
+INLINE_BRANCHES = {
+    'jp': ['self.pc = {nnn}'],
+    'se': ['self.pc = {skip} if r[{x}] == {kk} else {next}'],
+    'sne': ['self.pc = {skip} if r[{x}] != {kk} else {next}'],
+    'se2': ['self.pc = {skip} if r[{x}] == r[{y}] else {next}'],
+    'sne2': ['self.pc = {skip} if r[{x}] != r[{y}] else {next}'],
+    'skp': ['self.pc = {skip} if self.keyboard_keys[r[{x}] & 0xF] else {next}'],
+    'sknp': ['self.pc = {next} if self.keyboard_keys[r[{x}] & 0xF] else {skip}'],
+}
+
+# names of the operands decode_operands produces for each operand layout
+FIELDS = {
+    '': (),
+    'nnn': ('nnn',),
+    'xkk': ('x', 'kk'),
+    'xy': ('x', 'y'),
+    'xyn': ('x', 'y', 'n'),
+    'x': ('x',),
+    'opcode': ('opcode',),
+}
+
+# handlers that read or move the program counter, or write memory, so always end a block
+TERMINATORS = {'jp', 'call', 'ret', 'se', 'sne', 'se2', 'sne2', 'jp2', 'skp', 'sknp', 'ld5', 'ld9', 'ld10', UNKNOWN.handler}
+
+
+class JitChip8(Chip8):
+    """
+    Chip8 running translated blocks. Machine state matches the interpreter instruction for instruction, but
+    opcode/sample_instructions are not updated as blocks run.
+    """
+
+    def __init__(self, scale=10, seed=None) -> None:
+        if self.instructions is not INSTRUCTIONS:
+            # blocks inline the base handlers and assume a 12 bit pc moved only by the terminators
+            raise ValueError(f'{type(self).__name__} can only translate the chip8 instruction set, not an extended mode')
+        super().__init__(scale, seed)
+        # start address -> (block function, instruction count)
+        self.blocks = {}
+        # (start address, instruction budget) -> (block function, instruction count), blocks cut short at the budget
+        self.short_blocks = {}
+        # marks every memory byte some cached block was translated from
+        self.code_map = bytearray(len(self.memory))
+        # library entry of the loaded rom, its blocks map start address -> (block, code translated)
+        self.rom = None
+
+    def compile_block(self, addr, limit=MAX_BLOCK_LENGTH):
+        """
+        Translates the instructions starting at addr up to the first terminator, or at most limit of them, into a
+        python function and caches it
+        :param addr:
+        :param limit: instruction budget, blocks stopping short of a terminator because of it are cached apart
+        :return: (block function, instruction count), or None when there is no whole instruction at addr
+        """
+        shared = self.rom.blocks.get(type(self), {}).get(addr) if self.rom is not None else None
+        if shared is not None and shared[0][1] <= limit and self.memory[addr:addr + len(shared[1])] == shared[1]:
+            block = shared[0]
+            self.blocks[addr] = block
+            self.code_map[addr:addr + len(shared[1])] = b'\x01' * len(shared[1])
+            return block
+        cls = type(self)
+        lines = ['def block(self):', '    r = self.registers']
+        pc = addr
+        length = 0
+        ended = False
+        while length < limit and pc + 1 < len(self.memory):
+            opcode = self.memory[pc] << 8 | self.memory[pc + 1]
+            run, operands, op = self.decode_table[opcode]
+            fields = dict(zip(FIELDS[op.operands], operands), next=pc + 2, skip=pc + 4)
+            # subclasses overriding a handler get it called rather than the inlined base behaviour
+            overridden = getattr(cls, op.handler) is not getattr(Chip8, op.handler)
+            length += 1
+            if op.handler in INLINE and not overridden:
+                lines += ['    ' + line.format(**fields) for line in INLINE[op.handler]]
+            elif op.handler in INLINE_BRANCHES and not overridden:
+                lines += ['    ' + line.format(**fields) for line in INLINE_BRANCHES[op.handler]]
+                pc += 2
+                ended = True
+                break
+            elif op.handler in TERMINATORS:
+                lines += [f'    self.pc = {pc}', f'    self.{op.handler}({", ".join(map(str, operands))})', '    self.pc += 2']
+                pc += 2
+                ended = True
+                break
+            else:
+                lines.append(f'    self.{op.handler}({", ".join(map(str, operands))})')
+            pc += 2
+        else:
+            lines.append(f'    self.pc = {pc}')
+        if not length:
+            # off the end of memory, the interpreter fails there as it would
+            return None
+        namespace = {}
+        exec(compile('\n'.join(lines), f'<chip8 block 0x{addr:03x}>', 'exec'), namespace)
+        block = (namespace['block'], length)
+        self.code_map[addr:pc] = b'\x01' * (pc - addr)
+        if not ended and length == limit and limit < MAX_BLOCK_LENGTH:
+            # cut short by the budget, the full block from addr may be longer
+            self.short_blocks[addr, limit] = block
+            return block
+        self.blocks[addr] = block
+        # blocks of the rom as loaded are the same for every machine running it
+        start = self.rom_pointer
+        if self.rom is not None and start <= addr and self.memory[addr:pc] == self.rom.data[addr - start:pc - start]:
+            self.rom.blocks.setdefault(cls, {})[addr] = (block, bytes(self.memory[addr:pc]))
+        return block
+
+    def invalidate(self, addr, length):
+        """
+        Drops cached blocks translated from any of the bytes in memory[addr:addr + length]
+        :param addr:
+        :param length:
+        """
+        if not any(self.code_map[addr:addr + length]):
+            return
+        end = addr + length
+        for start, block in list(self.blocks.items()):
+            if start < end and addr < start + block[1] * 2:
+                del self.blocks[start]
+        for key, block in list(self.short_blocks.items()):
+            if key[0] < end and addr < key[0] + block[1] * 2:
+                del self.short_blocks[key]
+        self.code_map[:] = bytes(len(self.memory))
+        for start, block in self.blocks.items():
+            self.code_map[start:start + block[1] * 2] = b'\x01' * (block[1] * 2)
+        for (start, _), block in self.short_blocks.items():
+            self.code_map[start:start + block[1] * 2] = b'\x01' * (block[1] * 2)
+
+    def execute(self, count):
+        """
+        Runs up to count instructions block by block, blocks longer than what is left of count being cut short at it
+        :param count:
+        :return: number of instructions run
+        """
+        if self.is_instrumented:
+            # blocks run many instructions per call, profile and hook them through the interpreter instead
+            return super().execute(count)
+        blocks = self.blocks
+        short_blocks = self.short_blocks
+        remaining = count
+        while remaining > 0 and self.key_wait is None:
+            pc = self.pc
+            block = blocks.get(pc)
+            if block is None or block[1] > remaining:
+                limit = min(remaining, MAX_BLOCK_LENGTH)
+                block = short_blocks.get((pc, limit)) or self.compile_block(pc, limit)
+                if block is None:
+                    self.cycle(True)
+                    remaining -= 1
+                    continue
+            block[0](self)
+            remaining -= block[1]
+        return count - remaining
+
+    def run_cycles(self, count):
+        """
+        Runs a number of cpu cycles through the translated blocks without touching the timers
+        :param count:
+        """
+        if not self.is_paused:
+            self.execute(count)
+        self.cycle_count += count
+
+    def ld9(self, vx):
+        """
+        Fx33 - LD B, Vx, then drops any blocks built from the bytes written.
+        :param vx:
+        """
+        super().ld9(vx)
+        self.invalidate(self.index_register, 3)
+
+    def ld10(self, vx):
+        """
+        Fx55 - LD [I], Vx, then drops any blocks built from the bytes written.
+        :param vx:
+        """
+        super().ld10(vx)
+        self.invalidate(self.index_register, vx + 1)
+
+    def load_program(self, program):
+        """
+        Loads the program, drops every cached block and picks up the blocks already translated for it
+        :param program:
+        """
+        super().load_program(program)
+        self.invalidate(0, len(self.memory))
+        self.rom = LIBRARY.add(program)
+
+    def load_state(self, state):
+        """
+        Restores the machine state and drops every cached block
+        :param state:
+        """
+        super().load_state(state)
+        self.invalidate(0, len(self.memory))
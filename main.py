@@ -1,32 +1,85 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import random
+from array import array
 from pathlib import Path
 
 import imgui
 import pyglet
 from imgui.integrations.pyglet import create_renderer
+from pyglet.window import key
 
+from audio import PygletStream, StreamingAudio
 from chip8 import Chip8
+from movie import Recorder
+from renderer import TextureRenderer
+from romlibrary import LIBRARY
+from rewind import RewindBuffer
+from scheduler import FrameScheduler
+
+# maps the left hand side of a qwerty keyboard onto the chip8 hex keypad
+KEY_MAP = {
+    key._1: 1,
+    key._2: 2,
+    key._3: 3,
+    key._4: 0xc,
+    key.Q: 4,
+    key.W: 5,
+    key.E: 6,
+    key.R: 0xd,
+    key.A: 7,
+    key.S: 8,
+    key.D: 9,
+    key.F: 0xe,
+    key.Z: 0xa,
+    key.X: 0,
+    key.C: 0xb,
+    key.V: 0xf
+}
+# held down to run the emulator as fast as possible
+FAST_FORWARD_KEY = key.TAB
+# quick save slots, the key loads its slot and shift + key saves to it
+SLOT_KEYS = [key.F1, key.F2, key.F3, key.F4]
+# held down to run time backwards
+REWIND_KEY = key.BACKSPACE
 
 
 class MainGame:
-    def __init__(self, path_to_rom):
+    def __init__(self, path_to_rom, renderer_class=TextureRenderer, machine_class=Chip8):
         self.scale = 10
         self.width = 1000
         self.height = 32 * 20
-        self.window = pyglet.window.Window(width=self.width, height=self.height, resizable=False)
+        self.window = pyglet.window.Window(width=self.width, height=self.height, resizable=False, vsync=True)
         imgui.create_context()
         self.impl = create_renderer(self.window)
-        self.c8 = Chip8(self.scale)
+        # Chip8 or one of the extended modes in extended.py
+        self.c8 = machine_class(self.scale)
+        self.c8.attach_renderer(renderer_class(self.c8, self.scale))
+        self.audio_stream = PygletStream()
+        self.audio_stream.start()
+        self.c8.attach_audio(StreamingAudio(self.audio_stream))
         self.c8.load_rom(path_to_rom)
+        self.path_to_rom = Path(path_to_rom)
+        self.scheduler = FrameScheduler(self.c8)
+        self.save_slots = [None] * len(SLOT_KEYS)
+        # the last 10 seconds of frames
+        self.rewind = RewindBuffer(capacity=600)
+        self.rewinding = False
+        # set while a movie is being recorded, see movie.py
+        self.recorder = None
+        self.listing = LIBRARY.load(self.path_to_rom).disassembly(machine_class).listing()
+        # listing line of each address, for following the program counter
+        self.listing_lines = {address: line for line, (address, _) in enumerate(self.listing)}
+        self.follow_pc = True
 
         self.window.on_key_press = self.on_key_press
         self.window.on_key_release = self.on_key_release
         self.window.on_draw = self.on_draw
-        pyglet.clock.schedule_interval(self.update, 1.0 / 500)
+        pyglet.clock.schedule_interval(self.update, FrameScheduler.frame_time)
 
     def cleanup(self):
+        self.stop_recording()
         self.impl.shutdown()
 
     def debug_ui(self):
@@ -56,10 +109,7 @@ class MainGame:
 
         imgui.text("Index Register:")
         imgui.same_line()
-        if self.c8.index_register:
-            imgui.text_colored(f'0x{self.c8.index_register:x}', 0.2, 1., 0.)
-        else:
-            imgui.text_colored(f'Unknown', 0.2, 1., 0.)
+        imgui.text_colored(f'0x{self.c8.index_register:x}', 0.2, 1., 0.)
 
         imgui.text("Current Instruction:")
         imgui.same_line()
@@ -71,7 +121,9 @@ class MainGame:
         imgui.separator()
         imgui.text("Actions:")
         if imgui.button("RESET", 72, 30):
+            self.stop_recording()
             self.c8.reset()
+            self.rewind.clear()
         imgui.same_line()
         if imgui.button("PAUSE", 72, 30):
             self.c8.is_paused = True
@@ -81,7 +133,37 @@ class MainGame:
         imgui.same_line()
         if imgui.button("STEP", 72, 30):
             if self.c8.is_paused:
+                # single steps happen outside the frame clock a movie replays
+                self.stop_recording()
+                # recorded so BACK can undo the step
+                self.rewind.push(self.c8.save_state())
                 self.c8.cycle(True)
+        if imgui.button("BACK", 72, 30):
+            if self.c8.is_paused:
+                self.step_back()
+        imgui.same_line()
+        imgui.text(f"Rewind (BACKSPACE): {len(self.rewind)} frames, {self.rewind.size() // 1024} KB")
+
+        imgui.text("Save slots (F1-F4, shift to save):")
+        for slot, state in enumerate(self.save_slots):
+            if imgui.button(f"SAVE {slot + 1}", 72, 20):
+                self.quick_save(slot)
+            imgui.same_line()
+            if imgui.button(f"LOAD {slot + 1}", 72, 20):
+                self.quick_load(slot)
+            imgui.same_line()
+            imgui.text("empty" if state is None else f"{len(state)} bytes")
+
+        if self.recorder is None:
+            if imgui.button("RECORD", 72, 20):
+                self.start_recording()
+        elif imgui.button("STOP", 72, 20):
+            self.stop_recording()
+        imgui.same_line()
+        if self.recorder is None:
+            imgui.text(f"Movie: {self.path_to_rom.with_suffix('.c8m').name}")
+        else:
+            imgui.text(f"Recording: {len(self.recorder.movie.events)} events")
 
         imgui.separator()
         on_color_changed, color1 = imgui.color_edit3("Color 1", *[x / 255.0 for x in self.c8.on_color])
@@ -93,6 +175,20 @@ class MainGame:
             self.c8.off_color = (round(color2[0] * 255), round(color2[1] * 255), round(color2[2] * 255))
             self.c8.set_grid_colors()
 
+        imgui.separator()
+        imgui.text("Clock:")
+        ips_changed, ips = imgui.slider_int("IPS", self.c8.instructions_per_second, 60, 20000)
+        if ips_changed:
+            if self.recorder is not None:
+                self.recorder.set_instructions_per_second(ips)
+            else:
+                self.c8.instructions_per_second = ips
+        _, unthrottled = imgui.checkbox("Unthrottled", self.scheduler.unthrottled)
+        # unthrottled timers tick part way through a frame which a movie can't reproduce
+        self.scheduler.unthrottled = unthrottled and self.recorder is None
+        imgui.same_line()
+        _, self.scheduler.fast_forward = imgui.checkbox("Fast forward (TAB)", self.scheduler.fast_forward)
+
         imgui.end()
 
         imgui.begin("Execution", False, imgui.WINDOW_NO_RESIZE | imgui.WINDOW_NO_MOVE | imgui.WINDOW_NO_COLLAPSE)
@@ -118,18 +214,143 @@ class MainGame:
         imgui.columns(1)
         imgui.separator()
         imgui.end()
+
+        self.profiler_ui()
+        self.disassembly_ui()
         # tell imgui to render
         imgui.render()
 
+    def profiler_ui(self):
+        # starts collapsed as it sits over the display when opened
+        imgui.set_next_window_collapsed(True, imgui.ONCE)
+        imgui.set_next_window_position(10, 10, imgui.ONCE)
+        imgui.set_next_window_size(640, 320, imgui.ONCE)
+        imgui.begin("Profiler", False, imgui.WINDOW_NO_MOVE)
+        profiling_changed, profiling = imgui.checkbox("Profile", self.c8.is_profiling)
+        if profiling_changed:
+            if profiling:
+                self.c8.start_profiling()
+            else:
+                self.c8.stop_profiling()
+        profiler = self.c8.profiler
+        if profiler is not None:
+            imgui.same_line()
+            if imgui.button("CLEAR", 72, 20):
+                profiler.clear()
+            imgui.same_line()
+            if imgui.button("DUMP", 72, 20):
+                profiler.write_flamegraph(self.path_to_rom.with_suffix('.folded'))
+            imgui.same_line()
+            imgui.text(f"{profiler.total_executions:,} instructions, {profiler.total_seconds:.2f}s")
+
+            histogram = array('f', profiler.address_histogram())
+            imgui.plot_histogram("0x200-0xFFF", histogram, graph_size=(540, 60))
+
+            imgui.columns(2, 'profile')
+            imgui.separator()
+            imgui.text("instruction")
+            imgui.next_column()
+            imgui.text("address")
+            imgui.separator()
+            imgui.next_column()
+            total = profiler.total_seconds or 1.0
+            for asm, count, seconds in profiler.hot_instructions(10):
+                imgui.text(f'{seconds / total:6.1%} {count:>10,} {asm}')
+            imgui.next_column()
+            for pc, count, seconds in profiler.hot_addresses(10):
+                imgui.text(f'{seconds / total:6.1%} {count:>10,} 0x{pc:03x}')
+            imgui.columns(1)
+        imgui.end()
+
+    def disassembly_ui(self):
+        # starts collapsed below the profiler as it sits over the display when opened
+        imgui.set_next_window_collapsed(True, imgui.ONCE)
+        imgui.set_next_window_position(10, 32, imgui.ONCE)
+        imgui.set_next_window_size(640, 300, imgui.ONCE)
+        imgui.begin("Disassembly", False, imgui.WINDOW_NO_MOVE)
+        _, self.follow_pc = imgui.checkbox("Follow PC", self.follow_pc)
+        imgui.begin_child("listing", 0, 0, True)
+        line_height = imgui.get_text_line_height_with_spacing()
+        current = self.listing_lines.get(self.c8.pc)
+        if self.follow_pc and current is not None:
+            imgui.set_scroll_y(max(current * line_height - imgui.get_window_height() / 2, 0))
+        # only the lines in view are drawn, the rest is skipped over with spacing
+        first = int(imgui.get_scroll_y() // line_height)
+        last = min(first + int(imgui.get_window_height() // line_height) + 2, len(self.listing))
+        if first:
+            imgui.dummy(1, first * line_height)
+        for line in range(first, last):
+            if line == current:
+                imgui.text_colored(self.listing[line][1], 0.2, 1., 0.)
+            else:
+                imgui.text(self.listing[line][1])
+        if last < len(self.listing):
+            imgui.dummy(1, (len(self.listing) - last) * line_height)
+        imgui.end_child()
+        imgui.end()
+
+    def start_recording(self):
+        # movies play back from boot, so recording starts from a freshly loaded machine with a seed it can replay with
+        if self.c8.seed is None:
+            self.c8.seed = random.getrandbits(64)
+        self.c8.reset()
+        # reset keeps SUPER-CHIP's RPL user flags, a replay starts with them clear
+        if getattr(self.c8, 'rpl_flags', None) is not None:
+            self.c8.rpl_flags[:] = bytes(len(self.c8.rpl_flags))
+        self.c8.memory[self.c8.rom_pointer:] = bytes(len(self.c8.memory) - self.c8.rom_pointer)
+        self.c8.load_rom(self.path_to_rom)
+        self.c8.is_paused = False
+        self.rewind.clear()
+        self.scheduler.unthrottled = False
+        self.recorder = Recorder(self.c8, self.path_to_rom)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.finish().save(self.path_to_rom.with_suffix('.c8m'))
+            self.recorder = None
+
+    def quick_save(self, slot):
+        self.save_slots[slot] = self.c8.save_state()
+
+    def quick_load(self, slot):
+        if self.save_slots[slot] is not None:
+            self.stop_recording()
+            self.c8.load_state(self.save_slots[slot])
+
+    def step_back(self):
+        state = self.rewind.pop()
+        if state is not None:
+            self.stop_recording()
+            self.c8.load_state(state)
+
     def on_key_press(self, symbol, modifiers):
-        self.c8.key_press(symbol)
+        if symbol in KEY_MAP:
+            (self.recorder or self.c8).key_press(KEY_MAP[symbol])
+        elif symbol == FAST_FORWARD_KEY:
+            self.scheduler.fast_forward = True
+        elif symbol == REWIND_KEY:
+            self.rewinding = True
+        elif symbol in SLOT_KEYS:
+            if modifiers & key.MOD_SHIFT:
+                self.quick_save(SLOT_KEYS.index(symbol))
+            else:
+                self.quick_load(SLOT_KEYS.index(symbol))
 
     def on_key_release(self, symbol, modifiers):
-        self.c8.key_release(symbol)
+        if symbol in KEY_MAP:
+            (self.recorder or self.c8).key_release(KEY_MAP[symbol])
+        elif symbol == FAST_FORWARD_KEY:
+            self.scheduler.fast_forward = False
+        elif symbol == REWIND_KEY:
+            self.rewinding = False
 
     def update(self, dt):
-        # chip8 clock cycle
-        self.c8.cycle()
+        if self.rewinding:
+            self.step_back()
+            return
+        # run the chip8 frames due since the last update, recording where they got to
+        if self.scheduler.update(dt):
+            self.rewind.push(self.c8.save_state())
         # self.window.dispatch_events()
 
     def on_draw(self):
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic input recordings (movies) and headless replay.
+
+A movie holds the rom's SHA-1, the machine's mode and quirk profile, the rnd seed, the starting clock speed and every
+key change and clock change keyed by the cycle it happened at. Replaying it from boot on a headless core reproduces the
+recorded run exactly.
+
+    python movie.py movie.c8m rom [--engine interpreter|jit]
+"""
+import argparse
+import hashlib
+import struct
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+from batch import ENGINES
+from chip8 import Chip8
+from extended import MODES
+from quirks import PROFILES, quirk_class
+
+MOVIE_MAGIC = b'C8MV'
+MOVIE_VERSION = 2
+# magic, version, rom sha1, mode, quirk profile (empty for none), seed, cycles per frame, length in cycles, event count
+MOVIE_HEADER = struct.Struct('<4sB20s8s8sQHQI')
+# cycle, kind, value
+MOVIE_EVENT = struct.Struct('<QBH')
+
+KEY_DOWN = 0
+KEY_UP = 1
+CLOCK = 2
+
+
+def rom_sha1(path_to_rom):
+    """
+    Returns the SHA-1 digest of a rom file
+    :param path_to_rom:
+    """
+    return hashlib.sha1(Path(path_to_rom).read_bytes()).digest()
+
+
+def machine_mode(c8):
+    """
+    Names the mode and quirk profile a machine runs
+    :param c8:
+    :return: (key into extended.MODES, key into quirks.PROFILES or None)
+    """
+    # most derived first, XoChip8 being a SuperChip8 being a Chip8
+    mode = next(name for name, cls in reversed(MODES.items()) if isinstance(c8, cls))
+    quirks = next((name for name, profile in PROFILES.items() if profile is c8.quirks), None)
+    return mode, quirks
+
+
+@dataclass
+class Movie:
+    """Class for keeping track of a recorded run."""
+    rom_sha1: bytes = bytes(20)
+    mode: str = 'chip8'
+    quirks: str = None
+    seed: int = 0
+    cycles_per_frame: int = 8
+    length: int = 0
+    events: List[Tuple[int, int, int]] = field(default_factory=list)
+
+    def save(self, path):
+        """
+        Writes the movie to a file
+        :param path:
+        """
+        if self.seed is None:
+            raise ValueError('A movie needs the seed its run was started with to replay, not None')
+        with open(path, 'wb') as f:
+            f.write(MOVIE_HEADER.pack(MOVIE_MAGIC, MOVIE_VERSION, self.rom_sha1, self.mode.encode(),
+                                      (self.quirks or '').encode(), self.seed, self.cycles_per_frame, self.length,
+                                      len(self.events)))
+            f.write(b''.join(MOVIE_EVENT.pack(*event) for event in self.events))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a movie written by save
+        :param path:
+        :return: Movie
+        """
+        data = Path(path).read_bytes()
+        magic, version, sha1, mode, quirks, seed, cycles_per_frame, length, count = MOVIE_HEADER.unpack_from(data)
+        if magic != MOVIE_MAGIC or version != MOVIE_VERSION:
+            raise ValueError(f'Not a version {MOVIE_VERSION} chip8 movie')
+        events = list(MOVIE_EVENT.iter_unpack(data[MOVIE_HEADER.size:MOVIE_HEADER.size + count * MOVIE_EVENT.size]))
+        return cls(rom_sha1=sha1, mode=mode.rstrip(b'\0').decode(), quirks=quirks.rstrip(b'\0').decode() or None,
+                   seed=seed, cycles_per_frame=cycles_per_frame, length=length, events=events)
+
+
+class Recorder(object):
+    """
+    Records the inputs fed to a Chip8 from boot. Route key presses, releases and clock changes through it.
+    Timers must tick on frame boundaries (run_frame/run_until) for the recording to replay exactly.
+    """
+
+    def __init__(self, c8, path_to_rom) -> None:
+        super().__init__()
+        self.c8 = c8
+        mode, quirks = machine_mode(c8)
+        self.movie = Movie(rom_sha1=rom_sha1(path_to_rom), mode=mode, quirks=quirks, seed=c8.seed,
+                           cycles_per_frame=c8.cycles_per_frame)
+
+    def key_press(self, chip8_key):
+        """
+        Records and applies a key press
+        :param chip8_key:
+        """
+        self.movie.events.append((self.c8.cycle_count, KEY_DOWN, chip8_key))
+        self.c8.key_press(chip8_key)
+
+    def key_release(self, chip8_key):
+        """
+        Records and applies a key release
+        :param chip8_key:
+        """
+        self.movie.events.append((self.c8.cycle_count, KEY_UP, chip8_key))
+        self.c8.key_release(chip8_key)
+
+    def set_instructions_per_second(self, value):
+        """
+        Records and applies a clock speed change
+        :param value:
+        """
+        self.c8.instructions_per_second = value
+        self.movie.events.append((self.c8.cycle_count, CLOCK, self.c8.cycles_per_frame))
+
+    def finish(self):
+        """
+        Ends the recording at the current cycle
+        :return: Movie
+        """
+        self.movie.length = self.c8.cycle_count
+        return self.movie
+
+
+def replay(movie, path_to_rom, engine='interpreter'):
+    """
+    Boots a headless core in the movie's mode and quirk profile and drives it through the movie at full speed
+    :param movie:
+    :param path_to_rom:
+    :param engine: key into ENGINES, the extended modes only run on the interpreter
+    :return: the Chip8 as it was at the end of the recording
+    """
+    if rom_sha1(path_to_rom) != movie.rom_sha1:
+        raise ValueError(f'{path_to_rom} is not the rom this movie was recorded on')
+    if movie.mode not in MODES:
+        raise ValueError(f'Unknown mode {movie.mode}, expected one of {", ".join(MODES)}')
+    cls = ENGINES[engine]
+    if MODES[movie.mode] is not Chip8:
+        if cls is not Chip8:
+            raise ValueError(f'The {engine} engine can only replay chip8 movies, not {movie.mode}')
+        cls = MODES[movie.mode]
+    if movie.quirks is not None:
+        cls = quirk_class(cls, movie.quirks)
+    c8 = cls(seed=movie.seed)
+    c8.load_rom(path_to_rom)
+    c8.cycles_per_frame = movie.cycles_per_frame
+    for cycle, kind, value in movie.events:
+        if cycle > c8.cycle_count:
+            c8.run_until(cycles=cycle - c8.cycle_count)
+        if kind == KEY_DOWN:
+            c8.key_press(value)
+        elif kind == KEY_UP:
+            c8.key_release(value)
+        elif kind == CLOCK:
+            c8.cycles_per_frame = value
+    if movie.length > c8.cycle_count:
+        c8.run_until(cycles=movie.length - c8.cycle_count)
+    return c8
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a chip8 movie headlessly')
+    parser.add_argument('movie', type=Path, help='movie file')
+    parser.add_argument('rom', type=Path, help='rom the movie was recorded on')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='interpreter',
+                        help='execution engine, movies recorded in an extended mode need the interpreter')
+    args = parser.parse_args()
+
+    movie = Movie.load(args.movie)
+    start = time.perf_counter()
+    c8 = replay(movie, args.rom, args.engine)
+    elapsed = time.perf_counter() - start
+    print(f'{c8.cycle_count:,} cycles in {elapsed:.3f}s ({c8.cycle_count / elapsed:,.0f} cycles/s)')
+    print(f'framebuffer sha1 {hashlib.sha1(c8.framebuffer()).hexdigest()}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Execution profiler for the Chip8 core.
+
+Counts executions and wall time per instruction class and per program counter address, along with the time spent
+under each chip8 call stack so it can be written out as a flamegraph. Chip8.start_profiling swaps the profiled cycle in,
+so nothing is paid while profiling is off.
+"""
+import time
+
+
+class Profiler(object):
+    """
+    Collects per instruction, per address and per call stack execution counts and wall time
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # instruction asm -> [executions, seconds]
+        self.instructions = {}
+        # pc -> [executions, seconds]
+        self.addresses = {}
+        # (call addresses on the chip8 stack, instruction asm) -> seconds
+        self.stacks = {}
+        # call address -> subroutine address, so flamegraph frames can be named after the subroutine called
+        self.calls = {}
+
+    def clear(self):
+        """
+        Throws away everything collected so far
+        """
+        self.instructions.clear()
+        self.addresses.clear()
+        self.stacks.clear()
+        self.calls.clear()
+
+    def wrap(self, c8, cycle):
+        """
+        Builds a drop in replacement for c8.cycle that profiles each instruction it runs
+        :param c8:
+        :param cycle: the cycle function to time
+        :return: profiled cycle function
+        """
+        instructions = self.instructions
+        addresses = self.addresses
+        stacks = self.stacks
+        calls = self.calls
+        clock = time.perf_counter
+
+        def profiled_cycle(force=False):
+            if c8.is_paused and not force:
+                return
+            pc = c8.pc
+            depth = c8.sp
+            stack = tuple(c8.stack[:depth])
+            start = clock()
+            cycle(force)
+            elapsed = clock() - start
+            asm = c8.opcode.asm
+            entry = instructions.get(asm)
+            if entry is None:
+                entry = instructions[asm] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry = addresses.get(pc)
+            if entry is None:
+                entry = addresses[pc] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            key = (stack, asm)
+            stacks[key] = stacks.get(key, 0.0) + elapsed
+            if c8.sp > depth:
+                calls[c8.stack[depth]] = c8.pc
+
+        return profiled_cycle
+
+    @property
+    def total_executions(self):
+        """
+        Instructions profiled so far
+        """
+        return sum(count for count, _ in self.instructions.values())
+
+    @property
+    def total_seconds(self):
+        """
+        Wall time spent in the profiled instructions so far
+        """
+        return sum(seconds for _, seconds in self.instructions.values())
+
+    def hot_instructions(self, limit=None):
+        """
+        Lists the instruction classes by the time spent running them, most first
+        :param limit: number of entries to return, all of them when None
+        :return: list of (asm, executions, seconds)
+        """
+        hot = sorted(((asm, count, seconds) for asm, (count, seconds) in self.instructions.items()),
+                     key=lambda entry: entry[2], reverse=True)
+        return hot[:limit]
+
+    def hot_addresses(self, limit=None):
+        """
+        Lists the addresses by the time spent running the instruction there, most first
+        :param limit: number of entries to return, all of them when None
+        :return: list of (pc, executions, seconds)
+        """
+        hot = sorted(((pc, count, seconds) for pc, (count, seconds) in self.addresses.items()),
+                     key=lambda entry: entry[2], reverse=True)
+        return hot[:limit]
+
+    def address_histogram(self, start=0x200, end=0x1000, buckets=64):
+        """
+        Sums the executions falling into equal sized ranges of memory
+        :param start: first address covered
+        :param end: address after the last one covered
+        :param buckets: number of ranges
+        :return: list of executions per range
+        """
+        histogram = [0] * buckets
+        width = max((end - start) // buckets, 1)
+        for pc, (count, _) in self.addresses.items():
+            if start <= pc < end:
+                histogram[min((pc - start) // width, buckets - 1)] += count
+        return histogram
+
+    def write_flamegraph(self, path):
+        """
+        Writes the time under each call stack in the collapsed stack format read by flamegraph.pl and speedscope,
+        one 'main;sub_0x2a0;DRW Vx, Vy, nibble 1234' line per stack with the weight in microseconds
+        :param path:
+        """
+        with open(path, 'w') as f:
+            for (stack, asm), seconds in sorted(self.stacks.items()):
+                weight = round(seconds * 1e6)
+                if not weight:
+                    continue
+                frames = ['main'] + [f'sub_0x{self.calls[addr]:03x}' if addr in self.calls else f'call_0x{addr:03x}'
+                                     for addr in stack]
+                f.write(f'{";".join(frames + [asm])} {weight}\n')
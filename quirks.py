@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Quirk profiles, the behaviours chip8 interpreters disagree on.
+
+A profile isn't checked as instructions run. quirk_class builds, once per machine class and profile, a subclass with
+the profile's versions of the affected handlers swapped in, so its decode table holds them directly and a machine
+pays nothing for its quirks:
+
+    c8 = quirk_class(SuperChip8, 'schip')(seed=0)
+
+Whatever the profile, sprites start at Vx, Vy wrapped onto the display. Machines built without a profile keep the
+core's own behaviour, which clips a sprite starting off the display away entirely.
+"""
+from dataclasses import dataclass
+
+
+@dataclass
+class Quirks:
+    """Class for keeping track of a quirk profile."""
+    # 8xy6/8xyE shift Vy into Vx rather than shifting Vx in place
+    shift_vy: bool = False
+    # Fx55/Fx65 leave I at I + x + load_store_increment, None leaves I unchanged
+    load_store_increment: int = None
+    # Bnnn jumps to xnn + Vx rather than nnn + V0
+    jump_vx: bool = False
+    # pixels drawn off an edge of the display come back in on the opposite one rather than being clipped
+    wrap_sprites: bool = False
+    # 8xy1/8xy2/8xy3 reset VF to 0
+    logic_reset_vf: bool = False
+
+
+PROFILES = {
+    # the original COSMAC VIP interpreter
+    'chip8': Quirks(shift_vy=True, load_store_increment=1, logic_reset_vf=True),
+    # CHIP-48 on the HP48, which left I one short after Fx55/Fx65
+    'chip48': Quirks(load_store_increment=0, jump_vx=True),
+    # SUPER-CHIP 1.1
+    'schip': Quirks(jump_vx=True),
+    'xochip': Quirks(shift_vy=True, load_store_increment=1, wrap_sprites=True),
+}
+
+_quirk_classes = {}
+
+
+def quirk_class(cls, profile):
+    """
+    Builds (once per class and profile) a subclass of cls running with a quirk profile
+    :param cls: Chip8 or a subclass, e.g. an extended mode or JitChip8
+    :param profile: key into PROFILES
+    :return: class
+    """
+    key = (cls, profile)
+    quirked = _quirk_classes.get(key)
+    if quirked is None:
+        if profile not in PROFILES:
+            raise ValueError(f'Unknown quirk profile {profile}, expected one of {", ".join(PROFILES)}')
+        quirks = PROFILES[profile]
+        handlers = {'quirks': quirks, 'draw': wrapped_draw if quirks.wrap_sprites else wrapped_start_draw(cls)}
+        if quirks.shift_vy:
+            handlers.update(shr=shr_vy, shl=shl_vy)
+        if quirks.load_store_increment is not None:
+            handlers.update(advancing_load_store(cls, quirks.load_store_increment))
+        if quirks.jump_vx:
+            handlers['jp2'] = jp2_vx
+        if quirks.logic_reset_vf:
+            handlers.update(OR=or_reset_vf, AND=and_reset_vf, XOR=xor_reset_vf)
+        quirked = _quirk_classes[key] = type(f'{cls.__name__}_{profile}', (cls,), handlers)
+    return quirked
+
+
+def shr_vy(self, vx, vy):
+    """
+    8xy6 - SHR Vx, Vy, Set Vx = Vy SHR 1, VF being the bit shifted out.
+    :param vx:
+    :param vy:
+    """
+    registers = self.registers
+    flag = registers[vy] & 0x1
+    registers[vx] = registers[vy] >> 1
+    registers[0xF] = flag
+
+
+def shl_vy(self, vx, vy):
+    """
+    8xyE - SHL Vx, Vy, Set Vx = Vy SHL 1, VF being the bit shifted out.
+    :param vx:
+    :param vy:
+    """
+    registers = self.registers
+    flag = registers[vy] >> 7
+    registers[vx] = (registers[vy] << 1) & 0xFF
+    registers[0xF] = flag
+
+
+def jp2_vx(self, nnn):
+    """
+    Bxnn - JP Vx, addr, Jump to location xnn + Vx.
+    :param nnn:
+    """
+    self.pc = ((self.registers[nnn >> 8] + nnn) & 0xFFF) - 2
+
+
+def or_reset_vf(self, vx, vy):
+    """
+    8xy1 - OR Vx, Vy, Set Vx = Vx OR Vy, then VF = 0.
+    :param vx:
+    :param vy:
+    """
+    self.registers[vx] = self.registers[vx] | self.registers[vy]
+    self.registers[0xF] = 0
+
+
+def and_reset_vf(self, vx, vy):
+    """
+    8xy2 - AND Vx, Vy, Set Vx = Vx AND Vy, then VF = 0.
+    :param vx:
+    :param vy:
+    """
+    self.registers[vx] = self.registers[vx] & self.registers[vy]
+    self.registers[0xF] = 0
+
+
+def xor_reset_vf(self, vx, vy):
+    """
+    8xy3 - XOR Vx, Vy, Set Vx = Vx XOR Vy, then VF = 0.
+    :param vx:
+    :param vy:
+    """
+    self.registers[vx] = self.registers[vx] ^ self.registers[vy]
+    self.registers[0xF] = 0
+
+
+def advancing_load_store(cls, increment):
+    """
+    Builds Fx55 and Fx65 handlers leaving I advanced past the registers, calling cls's own first
+    :param cls:
+    :param increment: I ends up at I + x + increment
+    :return: dict of handler name -> function
+    """
+    ld10 = cls.ld10
+    ld11 = cls.ld11
+    # I wraps within memory, 12 bits or XO-CHIP's 16
+    mask = cls.memory_size - 1
+
+    def ld10_advancing(self, vx):
+        """
+        Fx55 - LD [I], Vx, Store registers V0 through Vx in memory starting at location I, then advance I.
+        :param vx:
+        """
+        ld10(self, vx)
+        self.index_register = (self.index_register + vx + increment) & mask
+
+    def ld11_advancing(self, vx):
+        """
+        Fx65 - LD Vx, [I], Read registers V0 through Vx from memory starting at location I, then advance I.
+        :param vx:
+        """
+        ld11(self, vx)
+        self.index_register = (self.index_register + vx + increment) & mask
+
+    return {'ld10': ld10_advancing, 'ld11': ld11_advancing}
+
+
+def wrapped_start_draw(cls):
+    """
+    Builds a draw wrapping the sprite's starting position onto the display before calling cls's own, which clips it
+    :param cls:
+    :return: draw function
+    """
+    draw = cls.draw
+
+    def draw_wrapped_start(self, vx, vy, sprite, sprite_width=8):
+        """
+        Called from drw, XORs the sprite onto the display starting at (Vx, Vy) wrapped onto it.
+        Pixels falling off the right or bottom edge are clipped.
+        """
+        return draw(self, vx % self.width, vy % self.height, sprite, sprite_width)
+
+    return draw_wrapped_start
+
+
+def wrapped_draw(self, vx, vy, sprite, sprite_width=8):
+    """
+    Called from drw, XORs each selected plane's share of the sprite rows onto the plane.
+    Pixels falling off an edge come back in on the opposite one.
+    :param vx:
+    :param vy:
+    :param sprite: rows of the sprite for each selected plane in turn
+    :param sprite_width: pixels in a sprite row
+    """
+    collision = 0
+    planes = self.selected_planes()
+    if planes:
+        width = self.width
+        height = self.height
+        full = (1 << width) - 1
+        x = vx % width
+        rows = len(sprite) // len(planes)
+        for i, grid in enumerate(planes):
+            for j, line in enumerate(sprite[i * rows:(i + 1) * rows]):
+                # line the row up with column 0 then rotate it right by x, pixels off the right edge wrapping round
+                bits = line << (width - sprite_width)
+                bits = (bits >> x | bits << (width - x)) & full
+                y = (vy + j) % height
+                row = grid[y]
+                collision |= row & bits
+                grid[y] = row ^ bits
+    return collision != 0
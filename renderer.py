@@ -0,0 +1,190 @@
+import pyglet
+from pyglet import shapes
+
+# the display area is sized for the 64x32 display at the renderer's scale, higher resolutions fit into the same area
+LORES_WIDTH = 64
+LORES_HEIGHT = 32
+
+
+def build_palette(colors, planes):
+    """
+    Builds a table mapping each byte of packed pixels to their RGB bytes. With one plane a byte holds 8 pixels of
+    it, with two planes the high nibble of a byte holds 4 pixels of the second plane and the low nibble the same 4
+    of the first
+    :param colors: [r, g, b] of each pixel value
+    :param planes: 1 or 2
+    :return: list of 256 bytes
+    """
+    colors = [bytes(color) for color in colors]
+    pixels = 8 // planes
+    return [b''.join(colors[sum((value >> (plane * pixels + pixels - 1 - bit) & 1) << plane for plane in range(planes))]
+                     for bit in range(pixels))
+            for value in range(256)]
+
+
+def encode_rows(planes, start, end, row_bytes, palette):
+    """
+    Converts display rows to RGB through a palette made by build_palette
+    :param planes: the bit-planes, one or two
+    :param start: first row
+    :param end: row after the last one
+    :param row_bytes: bytes in a packed row
+    :param palette:
+    :return: bytes, top row first
+    """
+    if len(planes) == 1:
+        return b''.join(palette[value] for row in planes[0][start:end] for value in row.to_bytes(row_bytes, 'big'))
+    first, second = planes
+    data = []
+    for row, other in zip(first[start:end], second[start:end]):
+        for value, other_value in zip(row.to_bytes(row_bytes, 'big'), other.to_bytes(row_bytes, 'big')):
+            data.append(palette[value >> 4 | other_value & 0xF0])
+            data.append(palette[value & 0xF | (other_value & 0xF) << 4])
+    return b''.join(data)
+
+
+class ShapeRenderer(object):
+    """Draws the chip8 grid as a batch of pyglet rectangles."""
+
+    def __init__(self, c8, scale) -> None:
+        super().__init__()
+        self.c8 = c8
+        self.scale = scale
+        self.batch = None
+        self.shape_grid = []
+        # (width, height) the rectangles were laid out for
+        self.size = None
+        # plane rows as they were last pushed to the rectangles, one tuple per display row
+        self.shown = []
+        self.resize()
+
+    def resize(self):
+        """
+        Lays a rectangle out for every pixel at the display's current resolution
+        """
+        c8 = self.c8
+        pixel = self.scale * LORES_WIDTH // c8.width
+        top = (32 * 20) - 20 + self.scale
+        # creating a batch object
+        self.batch = pyglet.graphics.Batch()
+        self.shape_grid = []
+        for i in range(c8.height):
+            shape_line = []
+            for j in range(c8.width):
+                shape_line.append(shapes.Rectangle((j * pixel) + 10, top - ((i + 1) * pixel), pixel, pixel, color=c8.off_color, batch=self.batch))
+            self.shape_grid.append(shape_line)
+        self.size = (c8.width, c8.height)
+        self.set_grid_colors()
+
+    def set_grid_colors(self):
+        """
+        sets the colors of every rectangle from the grid
+        """
+        colors = self.c8.colors()
+        width = self.c8.width
+        rows = list(zip(*self.c8.planes))
+        for i in range(len(self.shape_grid)):
+            for j in range(len(self.shape_grid[i])):
+                value = sum(((row >> (width - 1 - j)) & 1) << plane for plane, row in enumerate(rows[i]))
+                self.shape_grid[i][j].color = colors[value]
+        self.shown = rows
+
+    def update(self):
+        """
+        Recolors only the rectangles whose pixel changed since the last frame
+        """
+        c8 = self.c8
+        if (c8.width, c8.height) != self.size:
+            self.resize()
+            return
+        colors = c8.colors()
+        width = c8.width
+        rows = list(zip(*c8.planes))
+        for i in range(len(rows)):
+            changed = 0
+            for row, old in zip(rows[i], self.shown[i]):
+                changed |= row ^ old
+            if not changed:
+                continue
+            shape_line = self.shape_grid[i]
+            while changed:
+                bit = changed & -changed
+                value = 0
+                for plane, row in enumerate(rows[i]):
+                    if row & bit:
+                        value |= 1 << plane
+                shape_line[width - bit.bit_length()].color = colors[value]
+                changed ^= bit
+        self.shown = rows
+
+    def render(self):
+        """
+        Pushes the frame's changes then calls the pyglet batch render for rendering all the shapes
+        """
+        self.update()
+        self.batch.draw()
+
+
+class TextureRenderer(object):
+    """
+    Draws the chip8 grid as a single texture scaled up with nearest neighbour filtering. Each frame only the span of
+    rows that changed is converted and uploaded, so the 128x64 display costs no more per frame than the rows drawn to.
+    """
+
+    def __init__(self, c8, scale) -> None:
+        super().__init__()
+        self.c8 = c8
+        self.scale = scale
+        self.x = 10
+        self.y = (32 * 20) - 20 - ((LORES_HEIGHT - 1) * self.scale)
+        self.texture = None
+        # (width, height) the texture was created for
+        self.size = None
+        self.palette = []
+        # plane rows as they were last uploaded, one tuple per display row, None forces an upload
+        self.shown = None
+        self.set_grid_colors()
+
+    def resize(self):
+        """
+        Creates the texture at the display's current resolution
+        """
+        c8 = self.c8
+        self.texture = pyglet.image.Texture.create(c8.width, c8.height, min_filter=pyglet.gl.GL_NEAREST, mag_filter=pyglet.gl.GL_NEAREST)
+        self.size = (c8.width, c8.height)
+        self.shown = None
+
+    def set_grid_colors(self):
+        """
+        Rebuilds the palette mapping each byte of packed grid rows to its RGB pixels
+        """
+        self.palette = build_palette(self.c8.colors(), len(self.c8.planes))
+        self.shown = None
+
+    def update(self):
+        """
+        Uploads the rows that changed since the last frame to the texture
+        """
+        c8 = self.c8
+        if (c8.width, c8.height) != self.size:
+            self.resize()
+        rows = list(zip(*c8.planes))
+        if self.shown is None:
+            start, end = 0, c8.height
+        else:
+            if rows == self.shown:
+                return
+            changed = [i for i, (row, old) in enumerate(zip(rows, self.shown)) if row != old]
+            start, end = changed[0], changed[-1] + 1
+        data = encode_rows(c8.planes, start, end, c8.width // 8, self.palette)
+        # negative pitch as grid rows run top to bottom, the texture's rows bottom to top
+        image = pyglet.image.ImageData(c8.width, end - start, 'RGB', data, pitch=-c8.width * 3)
+        self.texture.blit_into(image, 0, c8.height - end, 0)
+        self.shown = rows
+
+    def render(self):
+        """
+        Uploads the frame then draws the texture scaled to the display size
+        """
+        self.update()
+        self.texture.blit(self.x, self.y, width=LORES_WIDTH * self.scale, height=LORES_HEIGHT * self.scale)
@@ -0,0 +1,66 @@
+import zlib
+from collections import deque
+
+
+class RewindBuffer(object):
+    """
+    Ring of Chip8 save states for stepping backwards in time.
+
+    Every keyframe_interval pushes a full state is kept as a keyframe, the states in between are stored as the
+    zlib compressed XOR of the state against that keyframe, which is mostly zeros, so a few hundred bytes of
+    history per frame at most.
+    """
+
+    def __init__(self, capacity=600, keyframe_interval=60) -> None:
+        super().__init__()
+        self.keyframe_interval = keyframe_interval
+        # entries are (keyframe, delta), delta is None for the keyframe itself
+        self.entries = deque(maxlen=capacity)
+        self.since_keyframe = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Forgets all history
+        """
+        self.entries.clear()
+        self.since_keyframe = 0
+
+    def push(self, state):
+        """
+        Records a state as the newest point in history
+        :param state: blob from Chip8.save_state
+        """
+        if not self.entries or self.since_keyframe >= self.keyframe_interval or len(state) != len(self.entries[-1][0]):
+            self.entries.append((state, None))
+            self.since_keyframe = 1
+        else:
+            keyframe = self.entries[-1][0]
+            delta = int.from_bytes(state, 'little') ^ int.from_bytes(keyframe, 'little')
+            self.entries.append((keyframe, zlib.compress(delta.to_bytes(len(state), 'little'), 1)))
+            self.since_keyframe += 1
+
+    def pop(self):
+        """
+        Removes and returns the newest state
+        :return: blob for Chip8.load_state, or None when there is no history left
+        """
+        if not self.entries:
+            return None
+        keyframe, delta = self.entries.pop()
+        self.since_keyframe -= 1
+        if delta is None:
+            # the next push has to start a new keyframe as the previous entries are relative to an older one
+            self.since_keyframe = self.keyframe_interval
+            return keyframe
+        state = int.from_bytes(zlib.decompress(delta), 'little') ^ int.from_bytes(keyframe, 'little')
+        return state.to_bytes(len(keyframe), 'little')
+
+    def size(self):
+        """
+        Returns roughly how many bytes of history are held
+        """
+        keyframes = {id(keyframe): len(keyframe) for keyframe, _ in self.entries}
+        return sum(keyframes.values()) + sum(len(delta) for _, delta in self.entries if delta is not None)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Process wide library of loaded roms keyed by SHA-1.
+
+Everything derived from a rom's bytes alone is kept with it, so loading the same rom again, or running it in job
+after job in a batch worker, doesn't parse it twice: the disassembly and the blocks JitChip8 translated from the rom's
+untouched memory image.
+"""
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict
+
+from chip8 import Chip8
+from disassembler import disassemble
+
+
+@dataclass
+class Rom:
+    """Class for keeping track of a rom in the library."""
+    sha1: str = ''
+    data: bytes = b''
+    # engine class -> {start address: translated block} built from the rom as loaded, see JitChip8.compile_block
+    blocks: Dict[type, dict] = field(default_factory=dict)
+
+    def disassembly(self, cls=Chip8):
+        """
+        Disassembles the rom, once per instruction set
+        :param cls: Chip8 or a subclass whose instruction set the rom uses
+        :return: Disassembly
+        """
+        return disassemble(self.data, cls=cls)
+
+
+class RomLibrary(object):
+    """
+    Roms by SHA-1
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.roms = {}
+
+    def add(self, data):
+        """
+        Looks a rom up by its contents, adding it when it's new
+        :param data: rom bytes
+        :return: Rom
+        """
+        data = bytes(data)
+        sha1 = hashlib.sha1(data).hexdigest()
+        rom = self.roms.get(sha1)
+        if rom is None:
+            rom = self.roms[sha1] = Rom(sha1=sha1, data=data)
+        return rom
+
+    def load(self, path_to_rom):
+        """
+        Reads a rom file in one go and looks it up
+        :param path_to_rom:
+        :return: Rom
+        """
+        with open(path_to_rom, 'rb') as f:
+            return self.add(f.read())
+
+    def clear(self):
+        """
+        Forgets every rom
+        """
+        self.roms.clear()
+
+
+LIBRARY = RomLibrary()
@@ -0,0 +1,84 @@
+import time
+
+
+class FrameScheduler(object):
+    """
+    Drives a Chip8 from wall clock time.
+
+    Throttled, emulated time advances in whole 60 Hz frames so the cpu and timers keep their ratio exactly, and
+    frames missed during a stall are caught up (up to max_catch_up_frames, beyond that they are dropped).
+    Unthrottled, the cpu runs flat out for busy_fraction of each update while the timers keep ticking at 60 Hz.
+    Fast forward runs as many whole frames as fit in busy_fraction of each update, so emulated time races ahead and
+    only the last of them gets rendered.
+    While the cpu is halted waiting on a key (Fx0A) only the timers are run, so waiting games cost next to nothing.
+    """
+    frame_time = 1.0 / 60
+
+    def __init__(self, c8, max_catch_up_frames=15, busy_fraction=0.75) -> None:
+        super().__init__()
+        self.c8 = c8
+        self.max_catch_up_frames = max_catch_up_frames
+        self.busy_fraction = busy_fraction
+        self.unthrottled = False
+        self.fast_forward = False
+        # wall clock time not yet turned into emulated frames
+        self.lag = 0.0
+
+    def update(self, dt):
+        """
+        Advances the emulator by dt seconds of wall clock time
+        :param dt:
+        :return: number of 60 Hz frames run
+        """
+        self.lag += dt
+        frames = int(self.lag / self.frame_time)
+        if frames > self.max_catch_up_frames:
+            frames = self.max_catch_up_frames
+            self.lag = 0.0
+        else:
+            self.lag -= frames * self.frame_time
+        if self.c8.is_paused:
+            return 0
+        if self.c8.key_wait is not None:
+            for _ in range(frames):
+                self.c8.run_frame()
+            return frames
+        if self.fast_forward:
+            return self.run_fast_forward(dt * self.busy_fraction)
+        if self.unthrottled:
+            self.run_unthrottled(frames, dt * self.busy_fraction)
+        else:
+            for _ in range(frames):
+                self.c8.run_frame()
+        return frames
+
+    def run_unthrottled(self, frames, budget):
+        """
+        Runs the cpu as fast as possible for budget seconds, ticking the timers frames times along the way
+        :param frames:
+        :param budget:
+        """
+        c8 = self.c8
+        now = time.perf_counter()
+        ticks = max(frames, 1)
+        for tick in range(ticks):
+            deadline = now + budget * (tick + 1) / ticks
+            while c8.key_wait is None and time.perf_counter() < deadline:
+                c8.run_cycles(c8.cycles_per_frame)
+            if tick < frames:
+                c8.tick_timers()
+
+    def run_fast_forward(self, budget):
+        """
+        Runs whole frames back to back for budget seconds
+        :param budget:
+        :return: number of 60 Hz frames run
+        """
+        c8 = self.c8
+        deadline = time.perf_counter() + budget
+        frames = 0
+        while c8.key_wait is None and time.perf_counter() < deadline:
+            c8.run_frame()
+            frames += 1
+        self.lag = 0.0
+        return frames
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the engine tests. The modules live at the top of the repository, so it is put on the path here.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ROM_START = 0x200
+
+
+def random_program(rng, length=48, self_modifying=False):
+    """
+    Builds a random program looping back to its start, with a subroutine after the loop for its calls
+    :param rng: random.Random
+    :param length: instructions in the loop body
+    :param self_modifying: point I into the program so Fx33/Fx55 overwrite its code
+    :return: rom bytes
+    """
+    end = ROM_START + length * 2
+    subroutine = end + 4
+    data = (ROM_START, end) if self_modifying else (0x400, 0x600)
+    ops = []
+    for _ in range(length):
+        x, y, kk = rng.randrange(16), rng.randrange(16), rng.randrange(256)
+        kind = rng.randrange(14)
+        if kind == 0:
+            ops.append(0x6000 | x << 8 | kk)
+        elif kind == 1:
+            ops.append(0x7000 | x << 8 | kk)
+        elif kind in (2, 3):
+            ops.append(0x8000 | x << 8 | y << 4 | rng.choice([0, 1, 2, 3, 4, 5, 6, 7, 0xE]))
+        elif kind == 4:
+            ops.append(0xA000 | rng.randrange(*data))
+        elif kind == 5:
+            ops.append(0xF000 | x << 8 | rng.choice([0x07, 0x15, 0x18, 0x1E, 0x29]))
+        elif kind == 6:
+            ops.append(0xF000 | rng.randrange(4) << 8 | rng.choice([0x33, 0x55, 0x65]))
+        elif kind == 7:
+            ops.append(0xD000 | x << 8 | y << 4 | rng.randrange(16))
+        elif kind == 8:
+            ops.append(rng.choice([0x3000 | x << 8 | kk, 0x4000 | x << 8 | kk, 0x5000 | x << 8 | y << 4,
+                                   0x9000 | x << 8 | y << 4]))
+        elif kind == 9:
+            ops.append(rng.choice([0xE09E, 0xE0A1]) | x << 8)
+        elif kind == 10:
+            ops.append(0x2000 | subroutine)
+        elif kind == 11:
+            ops.append(0xC000 | x << 8 | kk)
+        elif kind == 12:
+            ops.append(0x00E0)
+        else:
+            ops.append(0x7000 | x << 8 | kk)
+    # twice, so a skip landing on the first still loops
+    ops += [0x1000 | ROM_START, 0x1000 | ROM_START]
+    ops += [0x7000 | rng.randrange(16) << 8 | rng.randrange(256), 0x8004 | rng.randrange(16) << 8, 0x00EE]
+    return b''.join(op.to_bytes(2, 'big') for op in ops)
+
+
+@pytest.fixture
+def programs():
+    """
+    Random programs for checking engines against the interpreter, the same ones on every run
+    """
+    return random_program
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from chip8 import Chip8
+from extended import SuperChip8
+from jit import JitChip8
+
+
+def machine_state(c8):
+    return (bytes(c8.registers), c8.index_register, c8.pc, c8.sp, list(c8.stack[:c8.sp]), bytes(c8.memory),
+            list(c8.grid), c8.delay_timer, c8.sound_timer, c8.cycle_count, c8.frame_cycles, c8.key_wait)
+
+
+def run_steps(c8, program, seed, steps):
+    """
+    Drives a machine the ways the frontends do, recording its state after every step. An error ends the run and is
+    recorded in place of the state, the state partway through a block not being comparable.
+    """
+    c8.load_program(program)
+    rng = random.Random(seed)
+    states = []
+    for _ in range(steps):
+        action = rng.random()
+        try:
+            if action < 0.4:
+                c8.run_frame()
+            elif action < 0.7:
+                c8.run_until(cycles=rng.randint(1, 400))
+            elif action < 0.8:
+                c8.run_until(frames=rng.randint(1, 5))
+            elif action < 0.9:
+                c8.instructions_per_second = rng.choice([240, 480, 1000, 10000])
+            else:
+                c8.keyboard_keys[rng.randrange(16)] = rng.random() < 0.5
+        except (IndexError, ValueError) as e:
+            states.append((type(e), str(e)))
+            break
+        states.append(machine_state(c8))
+    return states
+
+
+@pytest.mark.parametrize('self_modifying', [False, True])
+def test_matches_interpreter(programs, self_modifying):
+    for seed in range(100):
+        program = programs(random.Random(seed), self_modifying=self_modifying)
+        expected = run_steps(Chip8(seed=seed), program, seed, 30)
+        assert run_steps(JitChip8(seed=seed), program, seed, 30) == expected, f'program {seed}'
+
+
+def test_block_longer_than_frame_budget():
+    # 20 straight-line instructions then a jump back, run 8 cycles a frame
+    program = b''.join((0x7001 | (i % 8) << 8).to_bytes(2, 'big') for i in range(20)) + b'\x12\x00'
+    c8 = JitChip8(seed=0)
+    c8.load_program(program)
+    for _ in range(100):
+        c8.run_frame()
+    interpreter = Chip8(seed=0)
+    interpreter.load_program(program)
+    for _ in range(100):
+        interpreter.run_frame()
+    assert machine_state(c8) == machine_state(interpreter)
+    # blocks cut short at the budget are reused, rather than one being built for every instruction
+    assert c8.short_blocks
+    assert len(c8.blocks) + len(c8.short_blocks) < 32
+
+
+def test_running_off_the_end_of_memory_raises():
+    for cls in (Chip8, JitChip8):
+        c8 = cls(seed=0)
+        c8.load_program(b'\x1f\xfe')
+        c8.memory[0xFFE:0x1000] = b'\x60\x00'
+        with pytest.raises(IndexError):
+            c8.run_until(cycles=10)
+
+
+def test_rejects_extended_modes():
+    class JitSuperChip8(JitChip8, SuperChip8):
+        pass
+
+    with pytest.raises(ValueError):
+        JitSuperChip8(seed=0)
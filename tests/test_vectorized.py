@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import random
+
+import numpy as np
+import pytest
+
+from chip8 import Chip8
+from vectorized import VectorChip8
+
+MACHINES = 3
+
+
+class FixedRandom(object):
+    """Stands in for both engines' generators, so Cxkk written by self-modifying code gives the same value in each."""
+
+    def getrandbits(self, bits):
+        return 0xA5
+
+    def integers(self, low, high, size):
+        return np.full(size, 0xA5, dtype=np.int64)
+
+
+def assert_same_machine(vector, m, c8, message):
+    assert bytes(vector.registers[m]) == bytes(c8.registers), message
+    assert vector.index_register[m] == c8.index_register, message
+    assert vector.pc[m] == c8.pc, message
+    assert vector.sp[m] == c8.sp and list(vector.stack[m][:c8.sp]) == list(c8.stack[:c8.sp]), message
+    assert bytes(vector.memory[m]) == bytes(c8.memory), message
+    assert [int(row) for row in vector.grid[m]] == list(c8.grid), message
+    assert (vector.delay_timer[m], vector.sound_timer[m]) == (c8.delay_timer, c8.sound_timer), message
+
+
+@pytest.mark.parametrize('self_modifying', [False, True])
+def test_matches_interpreter(programs, tmp_path, self_modifying):
+    rom = tmp_path / 'program.rom'
+    for seed in range(40):
+        rom.write_bytes(programs(random.Random(seed), self_modifying=self_modifying))
+        vector = VectorChip8(MACHINES)
+        vector.rng = FixedRandom()
+        vector.load_rom(rom)
+        machines = []
+        for _ in range(MACHINES):
+            c8 = Chip8()
+            c8.random = FixedRandom()
+            c8.load_rom(rom)
+            machines.append(c8)
+        rng = random.Random(seed)
+        for frame in range(60):
+            # each machine gets its own keys, so they branch apart and run in different groups
+            for m, c8 in enumerate(machines):
+                if c8 is not None and rng.random() < 0.2:
+                    chip8_key = rng.randrange(16)
+                    if c8.keyboard_keys[chip8_key]:
+                        c8.key_release(chip8_key)
+                        vector.key_release(m, chip8_key)
+                    else:
+                        c8.key_press(chip8_key)
+                        vector.key_press(m, chip8_key)
+            vector.run_frame()
+            for m, c8 in enumerate(machines):
+                if c8 is None:
+                    continue
+                try:
+                    c8.run_frame()
+                except (IndexError, ValueError):
+                    # the interpreter raises where the batch marks just that machine faulted
+                    assert vector.faulted[m], f'program {seed} machine {m} frame {frame}'
+                    machines[m] = None
+                    continue
+                assert not vector.faulted[m], f'program {seed} machine {m} frame {frame}'
+                assert_same_machine(vector, m, c8, f'program {seed} machine {m} frame {frame}')
+        assert np.array_equal(vector.faulted, [c8 is None for c8 in machines])
+
+
+def test_every_machine_running_off_the_end_of_memory(tmp_path):
+    rom = tmp_path / 'program.rom'
+    rom.write_bytes(b'\x1f\xff')
+    vector = VectorChip8(2)
+    vector.load_rom(rom)
+    vector.step()
+    # the whole batch faults in the same step rather than raising
+    vector.step()
+    vector.run_frame()
+    assert vector.faulted.all()
+    assert list(vector.pc) == [0xFFF, 0xFFF]
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Binary per-instruction execution traces.
+
+Chip8.start_tracing streams one fixed-size record per instruction executed (pc, opcode, I, timers and the register
+file after it ran) into a preallocated buffer which is written out whenever it fills, so memory stays bounded however
+long the run. The changed registers are recovered by comparing each record with the one before it.
+
+    python tracelog.py show trace.c8t [--start N] [--count N] [--pc ADDR] [--opcode VALUE/MASK]
+    python tracelog.py diff a.c8t b.c8t [--context N]
+"""
+import argparse
+import struct
+
+TRACE_MAGIC = b'C8TR'
+TRACE_VERSION = 1
+# magic, version, record size
+TRACE_HEADER = struct.Struct('<4sBH')
+# pc, opcode, I, delay timer, sound timer, V0-VF after the instruction ran
+TRACE_RECORD = struct.Struct('<HHHBB16s')
+# the record up to the registers, which are copied in after it straight from the register file
+TRACE_FIELDS = struct.Struct('<HHHBB')
+
+
+class TraceWriter(object):
+    """
+    Writes trace records through a fixed size buffer
+    """
+
+    def __init__(self, path, buffer_records=65536) -> None:
+        super().__init__()
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size))
+        self.buffer = bytearray(TRACE_RECORD.size * buffer_records)
+        self.offset = 0
+        self.records = 0
+
+    def wrap(self, c8, cycle):
+        """
+        Builds a drop in replacement for c8.cycle that traces each instruction it runs
+        :param c8:
+        :param cycle: the cycle function to trace
+        :return: traced cycle function
+        """
+        pack_into = TRACE_FIELDS.pack_into
+        buffer = self.buffer
+        size = TRACE_RECORD.size
+        fields = TRACE_FIELDS.size
+        end = len(buffer)
+        memory = c8.memory
+        registers = c8.registers
+
+        def traced_cycle(force=False):
+            if c8.is_paused and not force:
+                return
+            pc = c8.pc
+            opcode = memory[pc] << 8 | memory[pc + 1]
+            cycle(force)
+            offset = self.offset
+            pack_into(buffer, offset, pc, opcode, c8.index_register, c8.delay_timer, c8.sound_timer)
+            buffer[offset + fields:offset + size] = registers
+            self.offset = offset + size
+            if self.offset == end:
+                self.flush()
+
+        return traced_cycle
+
+    def flush(self):
+        """
+        Writes the buffered records to the file
+        """
+        self.file.write(memoryview(self.buffer)[:self.offset])
+        self.records += self.offset // TRACE_RECORD.size
+        self.offset = 0
+
+    def close(self):
+        """
+        Flushes and closes the file
+        """
+        self.flush()
+        self.file.close()
+
+
+def read_trace(path, chunk_records=65536):
+    """
+    Reads a trace written by TraceWriter a chunk at a time
+    :param path:
+    :param chunk_records: records read from the file at once
+    :return: generator of (pc, opcode, I, delay timer, sound timer, registers) tuples
+    """
+    with open(path, 'rb') as f:
+        magic, version, record_size = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != TRACE_RECORD.size:
+            raise ValueError(f'Not a version {TRACE_VERSION} chip8 trace')
+        while True:
+            chunk = f.read(TRACE_RECORD.size * chunk_records)
+            # a trace cut short mid record ends at the last whole one
+            chunk = chunk[:len(chunk) - len(chunk) % TRACE_RECORD.size]
+            if not chunk:
+                return
+            yield from TRACE_RECORD.iter_unpack(chunk)
+
+
+def changed_registers(record, previous):
+    """
+    Lists the registers an instruction changed
+    :param record:
+    :param previous: the record before it, None for the first
+    :return: list of (register, new value)
+    """
+    registers = record[5]
+    if previous is None:
+        return [(i, value) for i, value in enumerate(registers) if value]
+    return [(i, value) for i, (value, old) in enumerate(zip(registers, previous[5])) if value != old]
+
+
+def format_record(index, record, previous=None):
+    """
+    Formats a record as one line of text
+    :param index: position of the record in the trace
+    :param record:
+    :param previous: the record before it, so the changed registers can be shown
+    """
+    pc, opcode, index_register, delay_timer, sound_timer, _ = record
+    changes = ' '.join(f'V{i:X}=0x{value:02x}' for i, value in changed_registers(record, previous))
+    return f'{index:>10} 0x{pc:03x} {opcode:04x} I=0x{index_register:03x} DT={delay_timer:<3} ST={sound_timer:<3} {changes}'
+
+
+def diff_traces(path_a, path_b):
+    """
+    Finds the first record two traces disagree on
+    :param path_a:
+    :param path_b:
+    :return: index of the first differing record, or of the end of the shorter trace, None when they match
+    """
+    trace_a = read_trace(path_a)
+    trace_b = read_trace(path_b)
+    index = 0
+    while True:
+        record_a = next(trace_a, None)
+        record_b = next(trace_b, None)
+        if record_a != record_b:
+            return index
+        if record_a is None:
+            return None
+        index += 1
+
+
+def show_records(path, start, count, pc=None, opcode=None):
+    """
+    Lists records of a trace, optionally only those at pc or matching an opcode
+    :param path:
+    :param start: index of the first record shown
+    :param count: number of records shown at most
+    :param pc: only show records at this address
+    :param opcode: (value, mask), only show records whose opcode & mask == value
+    :return: list of formatted lines
+    """
+    lines = []
+    previous = None
+    for index, record in enumerate(read_trace(path)):
+        if index >= start and (pc is None or record[0] == pc) and (opcode is None or record[1] & opcode[1] == opcode[0]):
+            lines.append(format_record(index, record, previous))
+            if len(lines) == count:
+                break
+        previous = record
+    return lines
+
+
+def parse_opcode_filter(value):
+    """
+    Parses an opcode filter such as 0xD000/0xF000, a bare value matches exactly
+    :param value:
+    :return: (value, mask)
+    """
+    opcode, _, mask = value.partition('/')
+    return int(opcode, 0), int(mask or '0xFFFF', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect chip8 execution traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help='list the records of a trace')
+    show.add_argument('trace')
+    show.add_argument('--start', type=int, default=0, help='index of the first record')
+    show.add_argument('--count', type=int, default=50, help='records to show at most')
+    show.add_argument('--pc', type=lambda value: int(value, 0), help='only records at this address')
+    show.add_argument('--opcode', type=parse_opcode_filter, help='only records matching VALUE/MASK, e.g. 0xD000/0xF000')
+    diff = commands.add_parser('diff', help='find where two traces diverge')
+    diff.add_argument('trace_a')
+    diff.add_argument('trace_b')
+    diff.add_argument('--context', type=int, default=5, help='records shown before the divergence')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print('\n'.join(show_records(args.trace, args.start, args.count, args.pc, args.opcode)))
+        return
+    index = diff_traces(args.trace_a, args.trace_b)
+    if index is None:
+        print('traces match')
+        return
+    print(f'traces diverge at record {index}')
+    start = max(index - args.context, 0)
+    for path in (args.trace_a, args.trace_b):
+        print(path)
+        print('\n'.join(show_records(path, start, index - start + 1)) or '    (trace ended)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized batch engine.
+
+Runs N copies of a chip8 machine in lockstep with their state held in NumPy arrays. Each step fetches every machine's
+opcode, groups the machines by instruction and runs each instruction once over its whole group, so a batch of
+thousands of machines costs a handful of array operations per step rather than thousands of python calls.
+Requires numpy.
+"""
+import numpy as np
+
+from chip8 import BCD_TABLE, Chip8, INSTRUCTIONS, UNKNOWN, build_decode_table
+
+# instruction index (into INSTRUCTIONS, len(INSTRUCTIONS) meaning unknown) for every 16 bit opcode
+HANDLER_IDS = np.array([INSTRUCTIONS.index(op) if op is not UNKNOWN else len(INSTRUCTIONS) for _, _, op in build_decode_table(Chip8)], dtype=np.int32)
+# Fx33's three digits for every register value, one row each
+BCD_DIGITS = np.frombuffer(b''.join(BCD_TABLE), dtype=np.uint8).reshape(256, 3)
+
+
+class VectorChip8(object):
+    """
+    N chip8 machines stepped together. Arithmetic, timers, stack and display follow Chip8, registers are uint8.
+    A machine that hits an unknown opcode, overflows the stack or addresses memory out of range is marked faulted
+    and stops, rather than raising for the whole batch.
+    """
+    width = 64
+    height = 32
+
+    def __init__(self, count, seed=None) -> None:
+        super().__init__()
+        self.count = count
+        template = Chip8()
+        self.memory = np.tile(np.frombuffer(bytes(template.memory), dtype=np.uint8), (count, 1))
+        self.registers = np.zeros((count, 16), dtype=np.uint8)
+        self.index_register = np.zeros(count, dtype=np.int64)
+        self.pc = np.full(count, 0x200, dtype=np.int64)
+        self.stack = np.zeros((count, 16), dtype=np.int64)
+        self.sp = np.zeros(count, dtype=np.int64)
+        self.delay_timer = np.zeros(count, dtype=np.int64)
+        self.sound_timer = np.zeros(count, dtype=np.int64)
+        self.keyboard_keys = np.zeros((count, 16), dtype=bool)
+        # register each machine's Fx0A is waiting to fill, -1 while running
+        self.key_wait = np.full(count, -1, dtype=np.int64)
+        self.faulted = np.zeros(count, dtype=bool)
+        # display rows packed into uint64s like Chip8.grid, the leftmost pixel in the most significant bit
+        self.grid = np.zeros((count, self.height), dtype=np.uint64)
+        self.cycles_per_frame = template.cycles_per_frame
+        self.frame_cycles = 0
+        self.cycle_count = 0
+        self.rng = np.random.default_rng(seed)
+        self.all_machines = np.arange(count)
+        self.handlers = [getattr(self, op.handler) for op in INSTRUCTIONS] + [self.unknown]
+
+    def load_rom(self, path_to_rom):
+        """
+        Loads the same rom into every machine
+        :param path_to_rom:
+        """
+        space = self.memory.shape[1] - 0x200
+        with open(path_to_rom, 'rb') as f:
+            data = np.frombuffer(f.read(space + 1), dtype=np.uint8)
+        if len(data) > space:
+            raise ValueError(f'Rom is too big, only {space} bytes fit in memory after 0x200')
+        self.memory[:, 0x200:0x200 + len(data)] = data
+
+    def load_state(self, state, machines=None):
+        """
+        Restores a Chip8 save state into some or all of the machines, so a batch can fork from one checkpoint
+        :param state: blob from Chip8.save_state
+        :param machines: machine indices, defaults to every machine
+        """
+        c8 = Chip8()
+        c8.load_state(state)
+        if c8.sp > self.stack.shape[1]:
+            raise ValueError(f'Save state stack is deeper than {self.stack.shape[1]}')
+        machines = self.all_machines if machines is None else machines
+        self.memory[machines] = np.frombuffer(bytes(c8.memory), dtype=np.uint8)
+        self.registers[machines] = c8.registers
+        self.index_register[machines] = c8.index_register
+        self.pc[machines] = c8.pc
+        self.stack[machines] = 0
+        self.stack[machines, :c8.sp] = c8.stack[:c8.sp]
+        self.sp[machines] = c8.sp
+        self.delay_timer[machines] = c8.delay_timer
+        self.sound_timer[machines] = c8.sound_timer
+        self.keyboard_keys[machines] = c8.keyboard_keys
+        self.key_wait[machines] = -1 if c8.key_wait is None else c8.key_wait
+        self.faulted[machines] = False
+        self.grid[machines] = np.array(c8.grid, dtype=np.uint64)
+        # frame timing is shared by the whole batch
+        self.cycles_per_frame = c8.cycles_per_frame
+        self.frame_cycles = c8.frame_cycles
+        self.cycle_count = c8.cycle_count
+
+    def key_press(self, machine, chip8_key):
+        """
+        Presses a key on one machine, resuming it if it is halted on Fx0A
+        :param machine:
+        :param chip8_key:
+        """
+        self.keyboard_keys[machine, chip8_key] = True
+        if self.key_wait[machine] >= 0:
+            self.registers[machine, self.key_wait[machine]] = chip8_key
+            self.key_wait[machine] = -1
+            self.pc[machine] += 2
+
+    def key_release(self, machine, chip8_key):
+        """
+        Releases a key on one machine
+        :param machine:
+        :param chip8_key:
+        """
+        self.keyboard_keys[machine, chip8_key] = False
+
+    def fault(self, idx, bad):
+        """
+        Marks the machines idx[bad] as faulted
+        :param idx:
+        :param bad: bool mask over idx
+        :return: idx with the faulted machines removed
+        """
+        self.faulted[idx[bad]] = True
+        return idx[~bad]
+
+    def step(self):
+        """
+        Runs one instruction on every machine that is not halted or faulted
+        """
+        stopped = self.faulted | (self.key_wait >= 0)
+        idx = self.all_machines[~stopped] if stopped.any() else self.all_machines
+        if not len(idx):
+            return
+        pc = self.pc[idx]
+        if (pc > 0xFFE).any() or (pc < 0).any():
+            idx = self.fault(idx, (pc > 0xFFE) | (pc < 0))
+            if not len(idx):
+                return
+            pc = self.pc[idx]
+        opcode = self.memory[idx, pc].astype(np.int64) << 8 | self.memory[idx, pc + 1]
+        handler_ids = HANDLER_IDS[opcode]
+        first = handler_ids[0]
+        if (handler_ids == first).all():
+            self.handlers[first](idx, opcode)
+        else:
+            for handler_id in np.flatnonzero(np.bincount(handler_ids)):
+                group = handler_ids == handler_id
+                self.handlers[handler_id](idx[group], opcode[group])
+        running = ~self.faulted[idx]
+        self.pc[idx[running]] += 2
+
+    def run_cycles(self, count):
+        """
+        Steps every machine count times without touching the timers
+        :param count:
+        """
+        for _ in range(count):
+            self.step()
+        self.cycle_count += count
+
+    def tick_timers(self):
+        """
+        Counts every machine's delay and sound timers down by one, called at 60 Hz
+        """
+        np.subtract(self.delay_timer, 1, out=self.delay_timer, where=self.delay_timer > 0)
+        np.subtract(self.sound_timer, 1, out=self.sound_timer, where=self.sound_timer > 0)
+
+    def run_frame(self):
+        """
+        Runs one 60 Hz frame of emulated time, cycles_per_frame steps followed by a timer tick
+        """
+        self.run_cycles(max(self.cycles_per_frame - self.frame_cycles, 0))
+        self.frame_cycles = 0
+        self.tick_timers()
+
+    def cls(self, idx, opcode):
+        """
+        00E0 - CLS, Clear the display.
+        """
+        self.grid[idx] = 0
+
+    def ret(self, idx, opcode):
+        """
+        00EE - RET, Return from a subroutine.
+        """
+        idx = self.fault(idx, self.sp[idx] == 0)
+        self.sp[idx] -= 1
+        self.pc[idx] = self.stack[idx, self.sp[idx]]
+
+    def jp(self, idx, opcode):
+        """
+        1nnn - JP addr, Jump to location nnn.
+        """
+        self.pc[idx] = (opcode & 0x0FFF) - 2
+
+    def call(self, idx, opcode):
+        """
+        2nnn - CALL addr, Call subroutine at nnn.
+        """
+        keep = self.sp[idx] < self.stack.shape[1]
+        idx = self.fault(idx, ~keep)
+        opcode = opcode[keep]
+        self.stack[idx, self.sp[idx]] = self.pc[idx]
+        self.sp[idx] += 1
+        self.pc[idx] = (opcode & 0x0FFF) - 2
+
+    def se(self, idx, opcode):
+        """
+        3xkk - SE Vx, byte, Skip instruction if Vx = kk.
+        """
+        skip = self.registers[idx, (opcode & 0x0F00) >> 8] == (opcode & 0x00FF)
+        self.pc[idx[skip]] += 2
+
+    def sne(self, idx, opcode):
+        """
+        4xkk - SNE Vx, byte, Skip instruction if Vx != kk
+        """
+        skip = self.registers[idx, (opcode & 0x0F00) >> 8] != (opcode & 0x00FF)
+        self.pc[idx[skip]] += 2
+
+    def se2(self, idx, opcode):
+        """
+        5xy0 - SE Vx, Vy, Skip instruction if Vx = Vy
+        """
+        skip = self.registers[idx, (opcode & 0x0F00) >> 8] == self.registers[idx, (opcode & 0x00F0) >> 4]
+        self.pc[idx[skip]] += 2
+
+    def ld(self, idx, opcode):
+        """
+        6xkk - LD Vx, byte, Puts value kk into register Vx
+        """
+        self.registers[idx, (opcode & 0x0F00) >> 8] = opcode & 0x00FF
+
+    def add(self, idx, opcode):
+        """
+        7xkk - ADD Vx, byte, Set Vx = Vx + kk.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        self.registers[idx, vx] = (self.registers[idx, vx] + (opcode & 0x00FF)) & 0xFF
+
+    def ld2(self, idx, opcode):
+        """
+        8xy0 - LD Vx, Vy, Set Vx = Vy.
+        """
+        self.registers[idx, (opcode & 0x0F00) >> 8] = self.registers[idx, (opcode & 0x00F0) >> 4]
+
+    def OR(self, idx, opcode):
+        """
+        8xy1 - OR Vx, Vy, Set Vx = Vx OR Vy.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        self.registers[idx, vx] |= self.registers[idx, (opcode & 0x00F0) >> 4]
+
+    def AND(self, idx, opcode):
+        """
+        8xy2 - AND Vx, Vy, Set Vx = Vx AND Vy.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        self.registers[idx, vx] &= self.registers[idx, (opcode & 0x00F0) >> 4]
+
+    def XOR(self, idx, opcode):
+        """
+        8xy3 - XOR Vx, Vy, Set Vx = Vx XOR Vy.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        self.registers[idx, vx] ^= self.registers[idx, (opcode & 0x00F0) >> 4]
+
+    # the arithmetic below works out the flag, writes Vx, then writes VF last as the Chip8 handlers do, so the flag
+    # wins when Vx is VF
+
+    def add2(self, idx, opcode):
+        """
+        8xy4 - ADD Vx, Vy, Set Vx = Vx + Vy, set VF = carry.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        vy = (opcode & 0x00F0) >> 4
+        total = self.registers[idx, vx].astype(np.int64) + self.registers[idx, vy]
+        self.registers[idx, vx] = total & 0xFF
+        self.registers[idx, 0xF] = total >> 8
+
+    def sub(self, idx, opcode):
+        """
+        8xy5 - SUB Vx, Vy, Set Vx = Vx - Vy, set VF = NOT borrow.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        vy = (opcode & 0x00F0) >> 4
+        flag = self.registers[idx, vx] >= self.registers[idx, vy]
+        self.registers[idx, vx] = (self.registers[idx, vx].astype(np.int64) - self.registers[idx, vy]) & 0xFF
+        self.registers[idx, 0xF] = flag
+
+    def shr(self, idx, opcode):
+        """
+        8xy6 - SHR Vx {, Vy}, Set Vx = Vx SHR 1.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        flag = self.registers[idx, vx] & 0x1
+        self.registers[idx, vx] >>= 1
+        self.registers[idx, 0xF] = flag
+
+    def subn(self, idx, opcode):
+        """
+        8xy7 - SUBN Vx, Vy, Set Vx = Vy - Vx
+        """
+        vx = (opcode & 0x0F00) >> 8
+        vy = (opcode & 0x00F0) >> 4
+        flag = self.registers[idx, vy] >= self.registers[idx, vx]
+        self.registers[idx, vx] = (self.registers[idx, vy].astype(np.int64) - self.registers[idx, vx]) & 0xFF
+        self.registers[idx, 0xF] = flag
+
+    def shl(self, idx, opcode):
+        """
+        8xyE - SHL Vx {, Vy}, Set Vx = Vx SHL 1.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        flag = self.registers[idx, vx] >> 7
+        self.registers[idx, vx] <<= 1
+        self.registers[idx, 0xF] = flag
+
+    def sne2(self, idx, opcode):
+        """
+        9xy0 - SNE Vx, Vy, Skip instruction if Vx != Vy.
+        """
+        skip = self.registers[idx, (opcode & 0x0F00) >> 8] != self.registers[idx, (opcode & 0x00F0) >> 4]
+        self.pc[idx[skip]] += 2
+
+    def ld3(self, idx, opcode):
+        """
+        Annn - LD I, addr, Set I = nnn.
+        """
+        self.index_register[idx] = opcode & 0x0FFF
+
+    def jp2(self, idx, opcode):
+        """
+        Bnnn - JP V0, addr, Jump to location nnn + V0.
+        """
+        self.pc[idx] = ((self.registers[idx, 0] + (opcode & 0x0FFF)) & 0xFFF) - 2
+
+    def rnd(self, idx, opcode):
+        """
+        Cxkk - RND Vx, byte, Set Vx = random byte AND kk.
+        """
+        rand = self.rng.integers(0, 256, size=len(idx))
+        self.registers[idx, (opcode & 0x0F00) >> 8] = rand & opcode & 0x00FF
+
+    def drw(self, idx, opcode):
+        """
+        Dxyn - DRW Vx, Vy, nibble, Display n-byte sprite
+        """
+        x = self.registers[idx, (opcode & 0x0F00) >> 8].astype(np.int64)
+        y = self.registers[idx, (opcode & 0x00F0) >> 4].astype(np.int64)
+        n = opcode & 0x000F
+        addr = self.index_register[idx]
+        collision = np.zeros(len(idx), dtype=bool)
+        # line each sprite byte up with column x, shifting right instead when it hangs off the right edge
+        left = np.maximum(self.width - 8 - x, 0).astype(np.uint64)
+        right = np.maximum(x - (self.width - 8), 0).astype(np.uint64)
+        for row in range(int(n.max(initial=0))):
+            drawing = (row < n) & (x < self.width) & (y + row < self.height) & (addr + row < self.memory.shape[1])
+            if not drawing.any():
+                continue
+            sel = np.flatnonzero(drawing)
+            machines = idx[sel]
+            rows = y[sel] + row
+            sprite = self.memory[machines, addr[sel] + row].astype(np.uint64)
+            bits = (sprite << left[sel]) >> right[sel]
+            old = self.grid[machines, rows]
+            collision[sel] |= (old & bits) != 0
+            self.grid[machines, rows] = old ^ bits
+        self.registers[idx, 0xF] = collision
+
+    def skp(self, idx, opcode):
+        """
+        Ex9E - SKP Vx, Skip instruction if key in Vx is pressed
+        """
+        keys = self.registers[idx, (opcode & 0x0F00) >> 8] & 0xF
+        skip = self.keyboard_keys[idx, keys]
+        self.pc[idx[skip]] += 2
+
+    def sknp(self, idx, opcode):
+        """
+        ExA1 - SKNP Vx, Skip instruction if key in Vx is not pressed
+        """
+        keys = self.registers[idx, (opcode & 0x0F00) >> 8] & 0xF
+        skip = ~self.keyboard_keys[idx, keys]
+        self.pc[idx[skip]] += 2
+
+    def ld4(self, idx, opcode):
+        """
+        Fx07 - LD Vx, DT, Set Vx = delay timer value.
+        """
+        self.registers[idx, (opcode & 0x0F00) >> 8] = self.delay_timer[idx]
+
+    def ld5(self, idx, opcode):
+        """
+        Fx0A - LD Vx, K, Wait for a key press, store key in Vx.
+        """
+        self.key_wait[idx] = (opcode & 0x0F00) >> 8
+        self.pc[idx] -= 2
+
+    def ld6(self, idx, opcode):
+        """
+        Fx15 - LD DT, Vx, Set delay timer = Vx.
+        """
+        self.delay_timer[idx] = self.registers[idx, (opcode & 0x0F00) >> 8]
+
+    def ld7(self, idx, opcode):
+        """
+        Fx18 - LD ST, Vx, Set sound timer = Vx.
+        """
+        self.sound_timer[idx] = self.registers[idx, (opcode & 0x0F00) >> 8]
+
+    def add3(self, idx, opcode):
+        """
+        Fx1E - ADD I, Vx, Set I = I + Vx.
+        """
+        self.index_register[idx] = (self.index_register[idx] + self.registers[idx, (opcode & 0x0F00) >> 8]) & 0xFFF
+
+    def ld8(self, idx, opcode):
+        """
+        Fx29 - LD F, Vx, Set I = location of sprite for digit Vx.
+        """
+        self.index_register[idx] = (self.registers[idx, (opcode & 0x0F00) >> 8].astype(np.int64) & 0xF) * 5
+
+    def ld9(self, idx, opcode):
+        """
+        Fx33 - LD B, Vx, Store BCD representation of Vx in memory locations I, I+1, and I+2.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        bad = self.index_register[idx] + 3 > self.memory.shape[1]
+        idx, vx = self.fault(idx, bad), vx[~bad]
+        addr = self.index_register[idx]
+        self.memory[idx[:, None], addr[:, None] + np.arange(3)] = BCD_DIGITS[self.registers[idx, vx]]
+
+    def ld10(self, idx, opcode):
+        """
+        Fx55 - LD [I], Vx, Store registers V0 through Vx in memory starting at location I.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        bad = self.index_register[idx] + vx + 1 > self.memory.shape[1]
+        idx, vx = self.fault(idx, bad), vx[~bad]
+        addr = self.index_register[idx]
+        for register in range(int(vx.max(initial=-1)) + 1):
+            sel = vx >= register
+            self.memory[idx[sel], addr[sel] + register] = self.registers[idx[sel], register]
+
+    def ld11(self, idx, opcode):
+        """
+        Fx65 - LD Vx, [I], Read registers V0 through Vx from memory starting at location I.
+        """
+        vx = (opcode & 0x0F00) >> 8
+        bad = self.index_register[idx] + vx + 1 > self.memory.shape[1]
+        idx, vx = self.fault(idx, bad), vx[~bad]
+        addr = self.index_register[idx]
+        for register in range(int(vx.max(initial=-1)) + 1):
+            sel = vx >= register
+            self.registers[idx[sel], register] = self.memory[idx[sel], addr[sel] + register]
+
+    def unknown(self, idx, opcode):
+        """
+        Faults the machines, there is no instruction for the opcode.
+        """
+        self.faulted[idx] = True